@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of JSON stream decoding on multi-megabyte streams.
+
+Compares `JSONStreamDecoder` with the previous approach of appending chunks to a
+string buffer and calling `raw_decode` on the whole buffer after each chunk.
+
+Usage, from packages/ittia_check: PYTHONPATH=. python benchmarks/stream_decoder.py [size_mb]
+"""
+
+import json
+import sys
+import time
+
+from ittia_check.stream import JSONStreamDecoder
+
+def legacy_decode(chunks):
+    values = []
+    buffer = ""
+    for chunk in chunks:
+        if chunk.strip():
+            buffer += chunk
+            try:
+                while buffer:
+                    rep, index = json.JSONDecoder().raw_decode(buffer)
+                    values.append(rep)
+                    buffer = buffer[index:].lstrip()
+            except json.JSONDecodeError:
+                continue
+    return values
+
+def stream_decode(chunks):
+    decoder = JSONStreamDecoder()
+    values = []
+    for chunk in chunks:
+        values.extend(decoder.feed(chunk))
+    values.extend(decoder.close())
+    return values
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def get_cases(size_mb):
+    size = int(size_mb * 1024 * 1024)
+
+    # search results: many small newline delimited objects
+    item = {'url': 'https://example.com/page', 'title': 'Title ' * 10, 'content': 'Lorem ipsum {dolor} "sit" amet. ' * 10}
+    line = json.dumps(item) + "\n"
+    ndjson = line * (size // len(line))
+
+    # final report: one large object
+    report = json.dumps({'stage': 'final', 'content': {'summaries': [item] * (size // len(line))}}) + "\n"
+
+    return [
+        ("ndjson, small objects, 1 KiB chunks", split(ndjson, 1024)),
+        ("ndjson, small objects, 64 KiB chunks", split(ndjson, 64 * 1024)),
+        ("single large object, 4 KiB chunks", split(report, 4 * 1024)),
+    ]
+
+def bench(func, chunks):
+    start = time.perf_counter()
+    values = func(chunks)
+    return time.perf_counter() - start, values
+
+if __name__ == "__main__":
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    for name, chunks in get_cases(size_mb):
+        t_legacy, v_legacy = bench(legacy_decode, chunks)
+        t_stream, v_stream = bench(stream_decode, chunks)
+        assert v_legacy == v_stream
+        mb = sum(len(c) for c in chunks) / 1024 / 1024
+        print(f"{name} ({mb:.1f} MiB, {len(v_stream)} values): "
+              f"legacy {t_legacy:.3f}s, decoder {t_stream:.3f}s, {t_legacy / t_stream:.1f}x")
@@ -1,7 +1,10 @@
+__all__ = ['Check', 'JSONStreamDecoder', 'aiter_json']
+
 import httpx
-import json
 import logging
 
+from .stream import JSONStreamDecoder, aiter_json
+
 API_BASE_URL = "https://check.ittia.net"
 
 class Check():
@@ -37,30 +40,13 @@ class Check():
         result = None
         
         async with self.client.stream("GET", url, headers=self.headers) as response:
-            buffer = ""
-            async for chunk in response.aiter_text():
-                if chunk.strip():  # Only process non-empty chunks
-                    buffer += chunk
-                    
-                    # Attempt to load the buffer as JSON
-                    try:
-                        # Keep loading JSON until all data is consumed
-                        while buffer:
-                            # Try to load a complete JSON object
-                            rep, index = json.JSONDecoder().raw_decode(buffer)
+            async for rep in aiter_json(response.aiter_text()):
+                # Select the `final` stage only
+                if rep['stage'] != 'final':
+                    logging.debug(f"Stage {rep['stage']}: {rep['content']}")
+                else:
+                    result = rep['content']
 
-                            # Select the `final` stage only
-                            if rep['stage'] != 'final':
-                                logging.debug(f"Stage {rep['stage']}: {rep['content']}")
-                            else:
-                                result = rep['content']
-                                
-                            # Remove processed JSON and any leading whitespace from the buffer
-                            buffer = buffer[index:].lstrip()
-                    except json.JSONDecodeError:
-                        # If we encounter an error, we may not have a complete JSON object yet
-                        continue  # Continue to read more data
-                        
         if not result:
             logging.warning("No result found")
 
@@ -0,0 +1,181 @@
+"""
+Incremental decoder of JSON value streams.
+
+Shared by the client SDK and the server search ingestion.
+This is the only copy: the server installs this package, see requirements.base.txt.
+"""
+
+import json
+import logging
+import re
+from typing import Any, AsyncIterator, List, Optional
+
+_STRUCTURE = re.compile(r'[{}\[\]"]')  # outside strings
+_STRING_END = re.compile(r'["\\]')  # inside strings
+_NOT_SPACE = re.compile(r'\S')
+_SCALAR_END = re.compile(r'[\s{\["]')
+
+class JSONStreamDecoder():
+    """
+    Decode a stream of JSON values in newline delimited or concatenated framing.
+
+    Feed text chunks as they arrive and get the values completed by each chunk.
+    The cost is linear in the stream size regardless of how values are split into chunks:
+      - line framing first: chunks are split by newlines and each line is parsed once
+      - once a line is not one complete value (concatenated or multi-line values), switch to
+        scanning: state is carried across chunks, only structural characters are visited
+        and each complete value is parsed once
+
+    Usage:
+        decoder = JSONStreamDecoder()
+        for chunk in chunks:
+            for value in decoder.feed(chunk):
+                ...
+        decoder.close()
+    """
+
+    def __init__(self):
+        self._pieces = []  # text of the current value from previous chunks
+        self._mode = None  # None between values, or: container, string, scalar
+        self._depth = 0
+        self._escape = False  # chunk ended right after a backslash in a string
+        self._lines = True  # line framing until a line is not one complete value
+
+    def _emit(self, chunk: str, start: int, end: int, values: List[Any]):
+        self._pieces.append(chunk[start:end])
+        values.append(json.loads(''.join(self._pieces)))
+        self._pieces = []
+        self._mode = None
+
+    def _feed_lines(self, chunk: str, values: List[Any]) -> Optional[str]:
+        """Line framing, return the text left to scan if switched to scanning"""
+        pos = 0
+        while True:
+            nl = chunk.find('\n', pos)
+            if nl < 0:
+                if pos < len(chunk):
+                    self._pieces.append(chunk[pos:])
+                return None
+            self._pieces.append(chunk[pos:nl])
+            line = ''.join(self._pieces)
+            self._pieces = []
+            pos = nl + 1
+            if not line.strip():
+                continue
+            try:
+                values.append(json.loads(line))
+            except json.JSONDecodeError:
+                self._lines = False
+                return line + chunk[nl:]
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Add a text chunk, return list of values completed"""
+        values = []
+        if self._lines:
+            chunk = self._feed_lines(chunk, values)
+            if chunk is None:
+                return values
+        n = len(chunk)
+        pos = 0
+        start = 0  # start of the current value in this chunk
+        if self._escape and n:
+            pos = 1
+            self._escape = False
+
+        while pos < n:
+            if self._mode is None:
+                m = _NOT_SPACE.search(chunk, pos)
+                if not m:
+                    break
+                start = pos = m.start()
+                c = chunk[pos]
+                if c in '{[':
+                    self._mode, self._depth = 'container', 1
+                    pos += 1
+                elif c == '"':
+                    self._mode, self._depth = 'string', 0
+                    pos += 1
+                else:
+                    self._mode = 'scalar'
+                continue
+
+            if self._mode == 'string':
+                m = _STRING_END.search(chunk, pos)
+                if not m:
+                    pos = n
+                    break
+                if m.group() == '\\':
+                    if m.end() >= n:
+                        self._escape = True
+                        pos = n
+                        break
+                    pos = m.end() + 1  # skip the escaped character
+                    continue
+                pos = m.end()
+                if self._depth == 0:
+                    self._emit(chunk, start, pos, values)
+                else:
+                    self._mode = 'container'
+                continue
+
+            if self._mode == 'scalar':
+                m = _SCALAR_END.search(chunk, pos)
+                if not m:
+                    pos = n
+                    break
+                pos = m.start()
+                self._emit(chunk, start, pos, values)
+                continue
+
+            # container
+            m = _STRUCTURE.search(chunk, pos)
+            if not m:
+                pos = n
+                break
+            c = m.group()
+            pos = m.end()
+            if c == '"':
+                self._mode = 'string'
+            elif c in '{[':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(chunk, start, pos, values)
+
+        if self._mode is not None:
+            self._pieces.append(chunk[start:])
+        return values
+
+    def close(self) -> List[Any]:
+        """End of stream, return the last value if it is a scalar, raise ValueError on a truncated value"""
+        values = []
+        if self._lines:
+            line = ''.join(self._pieces)
+            self._pieces = []
+            if not line.strip():
+                return values
+            try:
+                return [json.loads(line)]
+            except json.JSONDecodeError:
+                self._lines = False
+                values = self.feed(line)
+        if self._mode == 'scalar':
+            self._emit('', 0, 0, values)
+        elif self._mode is not None:
+            raise ValueError("Stream ended within a JSON value")
+        return values
+
+async def aiter_json(chunks: AsyncIterator[str]) -> AsyncIterator[Any]:
+    """Yield JSON values from an async iterator of text chunks, e.g. `response.aiter_text()`, a truncated last value is skipped"""
+    decoder = JSONStreamDecoder()
+    async for chunk in chunks:
+        for value in decoder.feed(chunk):
+            yield value
+    try:
+        tail = decoder.close()
+    except ValueError:
+        logging.warning("Stream ended within a JSON value, ignored")
+        tail = []
+    for value in tail:
+        yield value
@@ -1,11 +1,11 @@
-import httpx
-from tenacity import retry, stop_after_attempt, wait_fixed
+import asyncio
+import time
+from urllib.parse import urlparse
 
-import utils
+from cache import read_cache
+from runtime import deadline, hedger, read_governor, retries, scheduler, transport
 from settings import settings
 
-client = httpx.AsyncClient(http2=True, follow_redirects=True)
-
 class ReadUrl():
     """
     Read one single url via API fetch endpoint.
@@ -15,6 +15,15 @@ class ReadUrl():
       - ok
       - error
       - not_implemented: fetch ok but not able to read content
+
+    Successful reads are cached, response contains key `cache`:
+      - status: hit | miss
+      - fetched_at: timestamp of the read from API
+
+    Reads are governed per hostname by `read_governor`: rate limited, hosts with an open circuit breaker
+    raise `HostUnavailable` without retry, and reads of healthier hosts get read slots first.
+
+    The timeout is capped by the request deadline, a hedged duplicate is sent once a read is slower than usual.
     """
     
     def __init__(self, url: str):
@@ -22,10 +31,38 @@ class ReadUrl():
         self.api = settings.SEARCH_BASE_URL + '/read'
         self.timeout = 120  # api request timeout, set higher cause api backend might need to try a few times
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(0.1), before_sleep=utils.retry_log_warning, reraise=True)
     async def get(self):
+        entry = await read_cache.get(self.url)
+        if entry:
+            return {**entry['rep'], 'cache': {'status': 'hit', 'fetched_at': entry['fetched_at']}}
+
+        rep = await self._fetch()
+        fetched_at = time.time()
+        if rep.get('status') == 'ok' and rep.get('content'):  # do not cache failed reads
+            await read_cache.set(self.url, rep, fetched_at)
+        return {**rep, 'cache': {'status': 'miss', 'fetched_at': fetched_at}}
+
+    @retries.policy('search')
+    async def _fetch(self):
         _data = {
             'url': self.url,
         }
-        response = await client.post(self.api, json=_data, timeout=self.timeout)
+        host = urlparse(self.url).hostname or ''
+        trial = await read_governor.acquire(host)
+        try:
+            async with scheduler.slot('read', priority=read_governor.priority(host)):
+                start = time.monotonic()
+                try:
+                    rep = await asyncio.wait_for(hedger.run('read', lambda: self._post(_data)), deadline.timeout(self.timeout))
+                except Exception:
+                    if not deadline.expired():  # out of time is not a failure of the host
+                        read_governor.record(host, False, time.monotonic() - start)
+                    raise
+            read_governor.record(host, rep.get('status') == 'ok' and bool(rep.get('content')), time.monotonic() - start)
+        finally:
+            read_governor.release(host, trial)  # cancelled or out of time, no result recorded
+        return rep
+
+    async def _post(self, data: dict) -> dict:
+        response = await transport.aclient('search').post(self.api, json=data, timeout=self.timeout)
         return response.json()
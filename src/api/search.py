@@ -1,8 +1,8 @@
 import httpx
-import json
-from tenacity import retry, stop_after_attempt, wait_fixed
+import logging
+from ittia_check.stream import aiter_json
 
-import utils
+from runtime import DeadlineExceeded, deadline, hedger, retries, scheduler, transport
 from settings import settings
 
 class SearchWeb():
@@ -10,48 +10,82 @@ class SearchWeb():
     Web search with a query with session support:
       - get more links following the previous searches
       - get all links of this session
+
+    The search stops at the request deadline with the links got so far,
+    a hedged duplicate search is sent once the first link is slower than usual.
     """
     def __init__(self, query: str):
         self.query = query
         self.api = settings.SEARCH_BASE_URL + '/search'
         self.timeout = 600  # api request timeout, set higher cause search backend might need to try a few times
-
-        self.client = httpx.AsyncClient(http2=True, follow_redirects=True, timeout=self.timeout)
         self.urls = []  # all urls got
         
     """
     Get JSON data from API stream output.
-    
-    TODO: 
-      - Is there a more standard way to process streamed JSON?
     """
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(0.1), before_sleep=utils.retry_log_warning, reraise=True)
     async def get(self, num: int = 10, all: bool = False):
         _data = {
             'query': self.query,
             'num': num,  # how many more urls to get
             'all': all,
         }
-        async with self.client.stream("POST", self.api, json=_data) as response:
-            buffer = ""
-            async for chunk in response.aiter_text():
-                if chunk.strip():  # Only process non-empty chunks
-                    buffer += chunk
-                    
-                    # Attempt to load the buffer as JSON
-                    try:
-                        # Keep loading JSON until all data is consumed
-                        while buffer:
-                            # Try to load a complete JSON object
-                            rep, index = json.JSONDecoder().raw_decode(buffer)
-                            _url = rep['url']
-                            # deduplication
-                            if _url not in self.urls:  # TODO: what if the new one contains same url but better metadata
-                                self.urls.append(_url)
-                                yield rep
-                                
-                            # Remove the processed part from the buffer
-                            buffer = buffer[index:].lstrip()  # Remove processed JSON and any leading whitespace
-                    except json.JSONDecodeError:
-                        # If we encounter an error, we may not have a complete JSON object yet
-                        continue  # Continue to read more data
+        async with scheduler.slot('search'):
+            try:
+                opened = await hedger.run('search', lambda: self._open(_data), discard=self._close)
+            except (httpx.TimeoutException, DeadlineExceeded):
+                if not deadline.expired():
+                    raise
+                logging.warning(f"Search reached deadline before any link: {self.query}")
+                return
+
+            try:
+                async for rep in self._iter(opened):
+                    _url = rep['url']
+                    # deduplication
+                    if _url not in self.urls:  # TODO: what if the new one contains same url but better metadata
+                        self.urls.append(_url)
+                        yield rep
+                    if deadline.expired():
+                        logging.warning(f"Search reached deadline, got {len(self.urls)} links: {self.query}")
+                        break
+            except (httpx.TimeoutException, DeadlineExceeded):
+                if not deadline.expired():
+                    raise
+                logging.warning(f"Search reached deadline, got {len(self.urls)} links: {self.query}")
+            finally:
+                await self._close(opened)
+
+    @retries.policy('search')
+    async def _open(self, data: dict) -> tuple:
+        """
+        Send the search request and wait for the first result, return (response, values iterator, first values).
+        Retried before any result is yielded only.
+        """
+        client = transport.aclient('search')
+        request = client.build_request("POST", self.api, json=data, timeout=deadline.timeout(self.timeout))
+        response = await client.send(request, stream=True)
+        try:
+            response.raise_for_status()
+            values = aiter_json(response.aiter_text())
+            try:
+                first = [await values.__anext__()]
+            except StopAsyncIteration:
+                first = []
+        except BaseException:
+            await response.aclose()
+            raise
+        return response, values, first
+
+    @staticmethod
+    async def _iter(opened: tuple):
+        _, values, first = opened
+        for rep in first:
+            yield rep
+        async for rep in values:
+            yield rep
+
+    @staticmethod
+    async def _close(opened: tuple):
+        response, values, _ = opened
+        await values.aclose()
+        await response.aclose()
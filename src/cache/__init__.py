@@ -0,0 +1,5 @@
+__all__ = ['EvidenceStore', 'ReadCache', 'VerdictCache', 'evidence_store', 'read_cache', 'verdict_cache']
+
+from .evidence import EvidenceStore, evidence_store
+from .read import ReadCache, read_cache
+from .verdict import VerdictCache, verdict_cache
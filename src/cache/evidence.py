@@ -0,0 +1,372 @@
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.node_parser import SentenceSplitter
+
+import utils
+from settings import settings
+
+class EvidenceStore():
+    """
+    Long-lived store of evidence chunks shared by all requests.
+
+    Files under `path`, one directory per embedding model:
+      - `vectors.{generation}.f32`: append-only float32 matrix of normalized chunk embeddings, memory-mapped for search
+      - `evidence.sqlite`: chunk text and metadata (URL, host, fetch time), row id is the matrix row
+
+    Documents are added incrementally, a URL already stored with the same content is skipped without embedding.
+    A URL with changed content, or stored more than `ttl` ago, replaces its old chunks.
+    The embedding dimension is recorded at the first add, vectors of another dimension are rejected.
+
+    Expired and replaced chunks are dropped by compaction, which rewrites the matrix and renumbers rows
+    under a new generation: above `max_size` rows the newest documents are kept up to half of it,
+    otherwise compaction runs once per `ttl` and drops expired ones.
+
+    Processes sharing `CACHE_DIR` share the store: appends hold a file lock, and each call first picks up
+    the rows added by other processes, or reloads after a compaction.
+
+    Search is exact cosine similarity over the rows of the requested hosts, which keeps per-host
+    candidate sets small without an ANN library dependency.
+    """
+
+    def __init__(self, path: str, model_name: str, chunk_size: int, ttl: int, max_size: int, chunk_overlap: int = 20):
+        """
+        Args:
+          - path: parent directory, files are kept in a sub directory of the embedding model
+          - model_name: embedding model of the stored vectors
+          - chunk_size: chunk size in tokens, same as the leaf size of per-request indexes
+          - ttl: max age of chunks in seconds, 0 to keep them until evicted by size
+          - max_size: max number of chunk rows, including replaced ones not compacted yet
+          - chunk_overlap: chunk overlap in tokens
+        """
+        self.path = os.path.join(path, utils.get_md5(model_name))
+        self.model_name = model_name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._file_db = os.path.join(self.path, 'evidence.sqlite')
+        self._file_lock = os.path.join(self.path, 'lock')
+        self._conn = None
+        self._lock = threading.Lock()
+        self._dim = None
+        self._generation = 0  # of the vectors file, incremented by compaction
+        self._size = 0  # number of rows in the matrix
+        self._vectors = None  # memory map, reopen after appends
+        self._hosts = {}  # host -> list of valid rows
+        self._urls = {}  # url hash -> list of valid rows
+        self._last_row = -1  # last row synced from the database
+
+    @property
+    def _file_vectors(self) -> str:
+        return os.path.join(self.path, f"vectors.{self._generation}.f32")
+
+    def _meta(self, key: str, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _expired(self, fetched_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - fetched_at > self.ttl
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock of the store files across processes, e.g. the web tier and `python -m jobs` workers"""
+        with open(self._file_lock, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Open files at the first use, avoid I/O at import, then sync rows added since the last call"""
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            conn = sqlite3.connect(self._file_db, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "row INTEGER PRIMARY KEY, url_hash TEXT NOT NULL, url TEXT NOT NULL, host TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL, text TEXT NOT NULL, stale INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                "url_hash TEXT PRIMARY KEY, content_hash TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value NOT NULL)")
+            conn.commit()
+            self._conn = conn
+
+            with self._locked():
+                self._sync()
+                _model = self._meta('model')
+                if _model is None:
+                    self._set_meta('model', self.model_name)
+                    conn.commit()
+                elif _model != self.model_name:
+                    raise ValueError(f"Evidence store {self.path} holds vectors of {_model}, not {self.model_name}")
+
+                # drop the partial row of an interrupted append, appends hold the lock so none is in progress
+                if self._dim and os.path.exists(self._file_vectors):
+                    row_bytes = self._dim * 4
+                    size = os.path.getsize(self._file_vectors)
+                    if size % row_bytes:
+                        with open(self._file_vectors, 'r+b') as f:
+                            f.truncate(size - size % row_bytes)
+
+                # vectors files of other generations, left by an interrupted compaction
+                for file in os.listdir(self.path):
+                    if file.startswith('vectors.') and os.path.join(self.path, file) != self._file_vectors:
+                        os.remove(os.path.join(self.path, file))
+        self._sync()
+
+    def _sync(self):
+        """
+        Index rows added by this or other processes since the last sync, start over after a compaction.
+        Rows of a URL replace its older rows, the database keeps only the latest content valid.
+        """
+        _generation = self._meta('generation', 0)
+        if _generation != self._generation:
+            self._generation = _generation
+            self._size, self._vectors, self._hosts, self._urls, self._last_row = 0, None, {}, {}, -1
+        if self._dim is None:
+            self._dim = self._meta('dim')
+            if self._dim is None:
+                return
+
+        added = {}  # url hash -> (host, rows)
+        for row, url_hash, host in self._conn.execute(
+            "SELECT row, url_hash, host FROM chunks WHERE row > ? AND stale = 0 ORDER BY row", (self._last_row,)
+        ):
+            added.setdefault(url_hash, (host, []))[1].append(row)
+            self._last_row = row
+        for url_hash, (host, rows) in added.items():
+            stale = set(self._urls.get(url_hash, []))
+            if stale:
+                for _rows in self._hosts.values():
+                    _rows[:] = [r for r in _rows if r not in stale]
+            self._urls[url_hash] = rows
+            self._hosts.setdefault(host, []).extend(rows)
+
+        if self._last_row + 1 > self._size:
+            self._size = self._last_row + 1
+            self._vectors = None
+
+    def _stored(self, url_hash: str, content_hash: str) -> bool:
+        """Whether the URL is stored with the same content and not expired"""
+        row = self._conn.execute("SELECT content_hash, fetched_at FROM docs WHERE url_hash = ?", (url_hash,)).fetchone()
+        return row is not None and row[0] == content_hash and not self._expired(row[1], time.time())
+
+    def _compact(self):
+        """
+        Rewrite the matrix with rows of valid chunks not expired, newest documents first up to the size bound.
+        The database switches to the new generation in one transaction, lock held.
+        """
+        now = time.time()
+        keep = self.max_size // 2 if self._size > self.max_size else self.max_size
+        docs, count = [], 0
+        for url_hash, fetched_at, rows in self._conn.execute(
+            "SELECT url_hash, MAX(fetched_at), COUNT(*) FROM chunks WHERE stale = 0 GROUP BY url_hash ORDER BY 2 DESC"
+        ):
+            if self._expired(fetched_at, now) or count + rows > keep:
+                break
+            docs.append(url_hash)
+            count += rows
+
+        old = self._map()
+        chunks = []  # (old row, url_hash, url, host, fetched_at, text)
+        for i in range(0, len(docs), 500):
+            _docs = docs[i:i + 500]
+            chunks.extend(self._conn.execute(
+                "SELECT row, url_hash, url, host, fetched_at, text FROM chunks"
+                f" WHERE stale = 0 AND url_hash IN ({','.join('?' * len(_docs))}) ORDER BY row", _docs,
+            ))
+        chunks.sort()
+
+        _generation = self._generation + 1
+        _file = os.path.join(self.path, f"vectors.{_generation}.f32")
+        with open(_file, 'wb') as f:
+            if chunks:
+                f.write(np.ascontiguousarray(old[[c[0] for c in chunks]]).tobytes())
+        try:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.executemany(
+                "INSERT INTO chunks (row, url_hash, url, host, fetched_at, text) VALUES (?, ?, ?, ?, ?, ?)",
+                [(row, *chunk[1:]) for row, chunk in enumerate(chunks)],
+            )
+            self._conn.execute("DELETE FROM docs WHERE url_hash NOT IN (SELECT url_hash FROM chunks)")
+            self._set_meta('generation', _generation)
+            self._set_meta('compacted_at', now)
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            os.remove(_file)
+            raise
+
+        _old_file = self._file_vectors
+        self._sync()
+        if os.path.exists(_old_file):
+            os.remove(_old_file)
+        logging.info(f"Evidence store compacted: {self.path}, {len(chunks)} of {len(old) if old is not None else 0} rows kept")
+
+    def _maybe_compact(self):
+        """Compact above the size bound, or once per TTL to drop expired chunks, lock held"""
+        if self._size > self.max_size or (self.ttl and self._size and time.time() - self._meta('compacted_at', 0) > self.ttl):
+            self._compact()
+
+    def _map(self):
+        if self._vectors is None and self._size:
+            self._vectors = np.memmap(self._file_vectors, dtype=np.float32, mode='r', shape=(self._size, self._dim))
+        return self._vectors
+
+    def _split(self, text: str) -> List[str]:
+        splitter = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        return [chunk for chunk in splitter.split_text(text) if chunk.strip()]
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        embed_model = Settings.embed_model
+        if hasattr(embed_model, 'get_text_embedding_array'):  # skip conversion to Python lists
+            return embed_model.get_text_embedding_array(texts)
+        return np.asarray(embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+
+    def add_doc(self, url: str, host: str, text: str, fetched_at: Optional[float] = None):
+        """
+        Add one document, skip if the URL is stored with the same content.
+        Blocking, run in threadpool.
+        """
+        url_hash = utils.get_md5(url)
+        content_hash = utils.get_md5(text)
+        with self._lock:
+            self._load()
+            if self._stored(url_hash, content_hash):
+                return
+
+        chunks = self._split(text)
+        if not chunks:
+            return
+        vectors = self._embed(chunks)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.ascontiguousarray(vectors / np.where(norms == 0, 1, norms), dtype=np.float32)
+        fetched_at = fetched_at or time.time()
+
+        with self._lock, self._locked():
+            self._sync()
+            if self._stored(url_hash, content_hash):  # added by another request meanwhile
+                return
+            if self._dim is not None and vectors.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} differs from stored {self._dim}")
+            try:
+                if self._dim is None:
+                    self._dim = vectors.shape[1]
+                    self._set_meta('dim', self._dim)
+                    self._set_meta('compacted_at', time.time())
+
+                # row IDs follow the file length, rows of a failed insert below are left unused
+                start = os.path.getsize(self._file_vectors) // (self._dim * 4) if os.path.exists(self._file_vectors) else 0
+                with open(self._file_vectors, 'ab') as f:
+                    f.write(vectors.tobytes())
+                rows = list(range(start, start + len(chunks)))
+
+                # replace chunks of the previous content
+                self._conn.execute("UPDATE chunks SET stale = 1 WHERE url_hash = ?", (url_hash,))
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, url_hash, url, host, fetched_at, text) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(row, url_hash, url, host, fetched_at, chunk) for row, chunk in zip(rows, chunks)],
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO docs (url_hash, content_hash, fetched_at) VALUES (?, ?, ?)",
+                    (url_hash, content_hash, fetched_at),
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._sync()
+            self._maybe_compact()
+
+    def add_docs(self, docs: List[dict]):
+        """Add documents of dict with keys: url, host, text, fetched_at (optional)"""
+        for doc in docs:
+            try:
+                self.add_doc(**doc)
+            except Exception as e:
+                logging.warning(f"Failed to add doc to evidence store: {doc.get('url')}, {e}")
+
+    def search(self, query_embedding: List[float], k: int, hosts: Optional[List[str]] = None) -> List[dict]:
+        """
+        Get top k chunks by cosine similarity.
+
+        Args:
+          - query_embedding: embedding of the query
+          - k: number of chunks to return
+          - hosts: search chunks of these hosts only, None for all
+        """
+        with self._lock:
+            self._load()
+            matrix = self._map()
+            if matrix is None:
+                return []
+            if len(query_embedding) != self._dim:
+                logging.warning(f"Query embedding dimension {len(query_embedding)} differs from stored {self._dim}")
+                return []
+            _generation = self._generation
+            if hosts is None:
+                rows = np.array(sorted(r for _rows in self._hosts.values() for r in _rows), dtype=np.int64)
+            else:
+                rows = np.array(sorted(r for host in hosts for r in self._hosts.get(host, [])), dtype=np.int64)
+        if not len(rows):
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = matrix[rows] @ query
+        if len(rows) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+
+        with self._lock:
+            _rows = [int(rows[i]) for i in top]
+            _meta = {
+                row: (url, host, fetched_at, text)
+                for row, url, host, fetched_at, text in self._conn.execute(
+                    f"SELECT row, url, host, fetched_at, text FROM chunks WHERE row IN ({','.join('?' * len(_rows))})", _rows
+                )
+            }
+            # rows were renumbered by a compaction meanwhile, read after the chunks
+            if self._meta('generation', 0) != _generation:
+                return []
+        now = time.time()
+        results = []
+        for i, row in zip(top, _rows):
+            if row not in _meta or self._expired(_meta[row][2], now):
+                continue
+            url, host, fetched_at, text = _meta[row]
+            results.append({
+                'id': str(row),
+                'score': float(scores[i]),
+                'text': text,
+                'metadata': {'url': url, 'host': host, 'fetched_at': fetched_at},
+            })
+        return results
+
+evidence_store = EvidenceStore(
+    path=os.path.join(settings.CACHE_DIR, 'evidence'),
+    model_name=settings.EMBEDDING_MODEL_NAME,
+    chunk_size=settings.INDEX_CHUNK_SIZES[-1],
+    ttl=settings.EVIDENCE_STORE_TTL,
+    max_size=settings.EVIDENCE_STORE_MAX_SIZE,
+)
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import utils
+from settings import settings
+
+class ReadCache():
+    """
+    Content-addressed cache of URL reads: URL MD5 -> `/read` API payload plus fetch time.
+
+    Recent entries are kept in memory, least recently used ones spill to disk as JSON files
+    and are loaded back into memory on hit. Disk I/O runs in threads off the event loop.
+
+    TTL can be set per domain, a domain rule also applies to its subdomains.
+    Expired entries are removed on read, spilled ones also by a sweep every `SWEEP_INTERVAL` seconds
+    once older than the longest TTL. Above `max_disk` bytes, the entries fetched earliest are removed.
+    """
+
+    SWEEP_INTERVAL = 600  # in seconds
+
+    def __init__(self, path: str, ttl: int, domain_ttl: dict, max_memory: int, max_disk: int):
+        """
+        Args:
+          - path: directory for spilled entries
+          - ttl: default time to live in seconds, 0 to disable the cache
+          - domain_ttl: TTL of specific domains, e.g. {'example.com': 3600}, 0 to not cache the domain
+          - max_memory: max number of entries kept in memory
+          - max_disk: max bytes of spilled entries
+        """
+        self.path = path
+        self.ttl = ttl
+        self.domain_ttl = domain_ttl
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+
+        self._memory = OrderedDict()
+        self._disk = None  # key -> (size, fetched_at) of spilled entries, fetched earliest first, scanned at the first disk access
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        self._last_sweep = 0
+
+    def get_ttl(self, url: str) -> int:
+        """Get TTL of the URL, the most specific domain rule wins"""
+        hostname = urlparse(url).hostname or ''
+        parts = hostname.split('.')
+        for i in range(len(parts)):
+            _domain = '.'.join(parts[i:])
+            if _domain in self.domain_ttl:
+                return self.domain_ttl[_domain]
+        return self.ttl
+
+    def _get_file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def _scan(self):
+        """Index entries spilled before, file modification time is set to the fetch time"""
+        if self._disk is not None:
+            return
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for file in files:
+                if not file.endswith('.json'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, file))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, file[:-len('.json')], stat.st_size))
+        entries.sort()
+        self._disk = OrderedDict((key, (size, fetched_at)) for fetched_at, key, size in entries)
+        self._disk_size = sum(size for _, _, size in entries)
+
+    def _remove_index(self, key: str):
+        size, _ = self._disk.pop(key, (0, None))
+        self._disk_size -= size
+
+    def _remove(self, key: str):
+        self._remove_index(key)
+        try:
+            os.remove(self._get_file(key))
+        except FileNotFoundError:
+            pass
+
+    def _trim(self):
+        """Remove expired entries from time to time, and the entries fetched earliest above `max_disk`"""
+        now = time.time()
+        if now - self._last_sweep > self.SWEEP_INTERVAL:
+            self._last_sweep = now
+            max_ttl = max([self.ttl, *self.domain_ttl.values()])
+            for key, (_, fetched_at) in list(self._disk.items()):
+                if now - fetched_at > max_ttl:
+                    self._remove(key)
+        while self._disk and self._disk_size > self.max_disk:
+            self._remove(next(iter(self._disk)))
+
+    def _spill(self, entries: list):
+        """Write entries evicted from memory to disk, blocking"""
+        try:
+            with self._disk_lock:
+                self._scan()
+                for key, entry in entries:
+                    _file = self._get_file(key)
+                    os.makedirs(os.path.dirname(_file), exist_ok=True)
+                    with open(_file, 'w') as f:
+                        json.dump(entry, f)
+                    os.utime(_file, (entry['fetched_at'], entry['fetched_at']))
+                    self._remove_index(key)
+                    size = os.path.getsize(_file)
+                    self._disk[key] = (size, entry['fetched_at'])
+                    self._disk_size += size
+                self._trim()
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f"Read cache spill failed: {e}")
+
+    def _load(self, key: str):
+        """Load and remove one entry from disk, it goes back to memory after, blocking"""
+        _file = self._get_file(key)
+        try:
+            with self._disk_lock:
+                self._scan()
+                with open(_file) as f:
+                    entry = json.load(f)
+                self._remove(key)
+            return entry
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Read cache load failed: {e}")
+            return None
+
+    async def _add(self, key: str, entry: dict):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        evicted = []
+        while len(self._memory) > self.max_memory:
+            evicted.append(self._memory.popitem(last=False))
+        if evicted:
+            await asyncio.to_thread(self._spill, evicted)
+
+    async def get(self, url: str):
+        """
+        Return cached entry `{'url', 'rep', 'fetched_at'}` of the URL.
+        Return None if missing or expired.
+        """
+        ttl = self.get_ttl(url)
+        if ttl <= 0:
+            return None
+
+        key = utils.get_md5(url)
+        entry = self._memory.pop(key, None) or await asyncio.to_thread(self._load, key)
+        if entry is None:
+            return None
+        if time.time() - entry['fetched_at'] > ttl:
+            return None
+
+        await self._add(key, entry)
+        return entry
+
+    async def set(self, url: str, rep: dict, fetched_at: float):
+        """Add a successful read"""
+        if self.get_ttl(url) <= 0:
+            return
+        entry = {
+            'url': url,
+            'rep': rep,
+            'fetched_at': fetched_at,
+        }
+        await self._add(utils.get_md5(url), entry)
+
+read_cache = ReadCache(
+    path=os.path.join(settings.CACHE_DIR, 'read'),
+    ttl=settings.READ_CACHE_TTL,
+    domain_ttl=settings.READ_CACHE_DOMAIN_TTL,
+    max_memory=settings.READ_CACHE_MAX_MEMORY,
+    max_disk=settings.READ_CACHE_MAX_DISK * 1024 * 1024,
+)
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from settings import settings
+
+class VerdictCache():
+    """
+    Persistent cache of statement summaries, keyed by the statement MD5 from `Check.get_statements`.
+
+    Backed by SQLite so cached verdicts survive restarts and are shared by workers on the same host.
+      - TTL: entries older than `ttl` seconds are treated as missing and removed on read.
+      - LRU: above `max_size` entries, the least recently accessed ones are evicted.
+
+    Cache errors are logged and treated as misses, a broken cache must not fail a check.
+    The cache is disabled if it can not be opened, for example `CACHE_DIR` not writable.
+    Calls do blocking I/O, run them in the threadpool from async code.
+    """
+
+    def __init__(self, path: str, ttl: int, max_size: int):
+        """
+        Args:
+          - path: SQLite file path, parent directory will be created if not exists
+          - ttl: time to live in seconds, 0 to disable the cache
+          - max_size: max number of entries to keep
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._conn = None
+        self._lock = threading.Lock()  # connection is shared by threadpool jobs
+        self.broken = False  # failed to open, stop trying
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0 and not self.broken
+
+    def _get_conn(self):
+        """Connect and create table at the first use, avoid I/O at import"""
+        if self._conn is None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS verdicts ("
+                    "key TEXT PRIMARY KEY, summary TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS verdicts_accessed ON verdicts (accessed)")
+                conn.commit()
+            except (OSError, sqlite3.Error) as e:
+                self.broken = True
+                logging.warning(f"Verdict cache disabled, failed to open {self.path}: {e}")
+                raise
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str):
+        """Return cached summary or None if missing or expired"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                row = conn.execute("SELECT summary, created FROM verdicts WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                summary, created = row
+                if now - created > self.ttl:
+                    conn.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE verdicts SET accessed = ? WHERE key = ?", (now, key))
+                conn.commit()
+            return json.loads(summary)
+        except (OSError, sqlite3.Error, ValueError) as e:
+            logging.warning(f"Verdict cache get failed: {e}")
+            return None
+
+    def set(self, key: str, summary: dict):
+        """Add or replace a summary, evict least recently used entries above `max_size`"""
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            _summary = json.dumps(summary)
+            with self._lock:
+                conn = self._get_conn()
+                conn.execute(
+                    "INSERT OR REPLACE INTO verdicts (key, summary, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, _summary, now, now),
+                )
+                count = conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+                if count > self.max_size:
+                    conn.execute(
+                        "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY accessed ASC LIMIT ?)",
+                        (count - self.max_size,),
+                    )
+                conn.commit()
+        except (OSError, sqlite3.Error, TypeError, ValueError) as e:
+            logging.warning(f"Verdict cache set failed: {e}")
+
+verdict_cache = VerdictCache(
+    path=os.path.join(settings.CACHE_DIR, 'verdicts.sqlite'),
+    ttl=settings.VERDICT_CACHE_TTL,
+    max_size=settings.VERDICT_CACHE_MAX_SIZE,
+)
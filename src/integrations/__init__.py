@@ -1,4 +1,5 @@
-__all__ = ['InfinityEmbedding', 'OllamaEmbedding']
+__all__ = ['InfinityEmbedding', 'NumpyVectorStore', 'OllamaEmbedding']
 
 from .infinity_embedding import InfinityEmbedding
-from .ollama_embedding import OllamaEmbedding
\ No newline at end of file
+from .numpy_vector_store import NumpyVectorStore
+from .ollama_embedding import OllamaEmbedding
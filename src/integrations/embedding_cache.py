@@ -0,0 +1,318 @@
+import asyncio
+import fcntl
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+import numpy as np
+
+import utils
+from settings import settings
+
+class _MemoryStore():
+    """
+    Ring buffer of float32 vectors, the oldest rows are overwritten when full.
+    Rows are allocated on demand up to `max_size`.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.rows = {}  # key -> row
+        self._keys = []  # row -> key
+        self._vectors = None
+        self._next = 0  # next row to write
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Copies of the vectors found, by key"""
+        return {key: np.array(self._vectors[self.rows[key]]) for key in keys if key in self.rows}
+
+    def add(self, keys: List[str], vectors: np.ndarray):
+        if self._vectors is None:
+            self._vectors = np.empty((min(1024, self.max_size), vectors.shape[1]), dtype=np.float32)
+        for key, vector in zip(keys, vectors):
+            if key in self.rows:
+                continue
+            row = self._next
+            if row >= len(self._vectors) and len(self._vectors) < self.max_size:  # grow
+                _size = min(len(self._vectors) * 2, self.max_size)
+                self._vectors = np.resize(self._vectors, (_size, self._vectors.shape[1]))
+            if row < len(self._keys):  # overwrite the oldest
+                del self.rows[self._keys[row]]
+                self._keys[row] = key
+            else:
+                self._keys.append(key)
+            self._vectors[row] = vector
+            self.rows[key] = row
+            self._next = (row + 1) % self.max_size
+
+class _DiskStore():
+    """
+    Append-only store on disk, memory-mapped for reads:
+      - `{name}.{dim}.f32`: raw float32 rows
+      - `{name}.{dim}.keys`: one key per line, line number is the row
+
+    Vectors are written before keys, rows without a complete key line are dropped.
+    Above `max_size` rows, the oldest half is dropped by rewriting both files.
+
+    Processes sharing the directory share the store: reads hold a shared file lock, writes an exclusive one,
+    and each call first picks up rows appended or compacted by other processes.
+    """
+
+    def __init__(self, path: str, name: str, max_size: int):
+        self.path = path
+        self.name = name
+        self.max_size = max_size
+        self.rows = {}
+        self.dim = None
+        self._vectors = None  # memory map, reopen after appends
+        self._inode = None  # keys file read so far, replaced by compaction
+        self._offset = 0  # bytes of the keys file read so far
+
+        os.makedirs(path, exist_ok=True)
+        self._file_lock = os.path.join(path, f"{name}.lock")
+        with self._locked(exclusive=True):
+            self._sync(repair=True)
+
+    @property
+    def _file_vectors(self) -> str:
+        return os.path.join(self.path, f"{self.name}.{self.dim}.f32")
+
+    @property
+    def _file_keys(self) -> str:
+        return os.path.join(self.path, f"{self.name}.{self.dim}.keys")
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        """File lock across processes, shared for reads and exclusive for writes"""
+        with open(self._file_lock, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _find_dim(self):
+        for file in sorted(os.listdir(self.path)):
+            _name, _, _dim = file[:-len('.keys')].rpartition('.') if file.endswith('.keys') else ('', '', '')
+            if _name == self.name and _dim.isdigit():
+                self.dim = int(_dim)
+                return
+
+    def _sync(self, repair: bool = False):
+        """
+        Read keys added since the last call, start over if the files were rewritten.
+        Keys without a complete vector are ignored, and with `repair` (exclusive lock held)
+        both files are truncated to the complete rows, e.g. after an interrupted append.
+        """
+        if self.dim is None:
+            self._find_dim()
+            if self.dim is None:
+                return
+        try:
+            stat = os.stat(self._file_keys)
+        except FileNotFoundError:
+            stat = None
+        inode = stat.st_ino if stat else None
+        if inode != self._inode or (stat and stat.st_size < self._offset):
+            self.rows, self._offset, self._inode, self._vectors = {}, 0, inode, None
+        if stat is None:
+            return
+
+        with open(self._file_keys, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1]
+        if complete:
+            for key in complete.decode().split('\n')[:-1]:
+                self.rows[key] = len(self.rows)
+            self._offset += len(complete)
+            self._vectors = None
+
+        size = os.path.getsize(self._file_vectors) if os.path.exists(self._file_vectors) else 0
+        count = min(len(self.rows), size // (self.dim * 4))
+        dropped = count < len(self.rows)
+        if dropped:  # keys without vectors
+            self.rows = {key: row for key, row in self.rows.items() if row < count}
+            self._vectors = None
+        if repair and (dropped or len(complete) < len(data) or size != count * self.dim * 4):
+            self._write(sorted(self.rows, key=self.rows.get), None, count)
+
+    def _write(self, keys: List[str], vectors: Optional[np.ndarray], count: int = None):
+        """
+        Rewrite the files with `keys` and their `vectors`, exclusive lock held.
+        If `vectors` is None, keep the first `count` rows of the vectors file.
+        """
+        if vectors is None:
+            with open(self._file_vectors, 'ab') as f:
+                f.truncate(count * self.dim * 4)
+        else:
+            _tmp = self._file_vectors + '.tmp'
+            with open(_tmp, 'wb') as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            os.replace(_tmp, self._file_vectors)
+        _tmp = self._file_keys + '.tmp'
+        with open(_tmp, 'w') as f:
+            f.write(''.join(f"{key}\n" for key in keys))
+        os.replace(_tmp, self._file_keys)
+        self.rows = {key: row for row, key in enumerate(keys)}
+        stat = os.stat(self._file_keys)
+        self._inode, self._offset, self._vectors = stat.st_ino, stat.st_size, None
+
+    def _compact(self, keep: int):
+        """Keep the newest `keep` rows"""
+        keys = sorted(self.rows, key=self.rows.get)[len(self.rows) - keep:]
+        vectors = np.array(self._map()[len(self.rows) - keep:]) if keep else np.empty((0, self.dim), dtype=np.float32)
+        self._write(keys, vectors)
+        logging.info(f"Embedding cache compacted: {self._file_vectors}, {keep} rows kept")
+
+    def _map(self):
+        if self._vectors is None and self.rows:
+            self._vectors = np.memmap(self._file_vectors, dtype=np.float32, mode='r', shape=(len(self.rows), self.dim))
+        return self._vectors
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Copies of the vectors found, by key"""
+        with self._locked():
+            self._sync()
+            rows = {key: self.rows[key] for key in keys if key in self.rows}
+            if not rows:
+                return {}
+            vectors = self._map()
+            return {key: np.array(vectors[row]) for key, row in rows.items()}
+
+    def add(self, keys: List[str], vectors: np.ndarray):
+        with self._locked(exclusive=True):
+            self._sync(repair=True)
+            _new = {key: vector for key, vector in zip(keys, vectors) if key not in self.rows}
+            if not _new:
+                return
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} differs from cached {self.dim}")
+            _new = list(_new.items())[-self.max_size:]
+            if len(self.rows) + len(_new) > self.max_size:
+                self._compact(min(len(self.rows), self.max_size // 2, self.max_size - len(_new)))
+            with open(self._file_vectors, 'ab') as f:
+                f.write(np.asarray([v for _, v in _new], dtype=np.float32).tobytes())
+            with open(self._file_keys, 'a') as f:
+                f.write(''.join(f"{key}\n" for key, _ in _new))
+            self._sync()
+
+class EmbeddingCache():
+    """
+    Cache of text embeddings keyed by (model name, text MD5).
+
+    Vectors are kept as float32 rows of one matrix per model:
+      - memory: ring buffer of `max_size` rows, the oldest are overwritten first
+      - disk (optional): append-only memory-mapped file per model under `path`, survives restarts,
+        the oldest half is dropped above `max_size` rows
+
+    Only texts not found are sent to the embedding server, results are merged back in order.
+    Results are lists of floats for LlamaIndex, or a float32 matrix with `as_array`.
+
+    Cache errors are logged and treated as misses, a broken cache must not fail embedding.
+    The cache is disabled if the disk store can not be opened, for example `CACHE_DIR` not writable.
+    """
+
+    def __init__(self, max_size: int, path: str = None):
+        """
+        Args:
+          - max_size: max number of vectors per model in memory or on disk, 0 to disable the cache
+          - path: directory of the disk store, None to use memory only
+        """
+        self.max_size = max_size
+        self.path = path
+
+        self._stores = {}
+        self._lock = threading.Lock()  # index builds run in threadpool
+        self.broken = False  # failed to open, stop trying
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and not self.broken
+
+    def _get_store(self, model_name: str):
+        store = self._stores.get(model_name)
+        if store is None:
+            if self.path:
+                try:
+                    store = _DiskStore(self.path, utils.get_md5(model_name), self.max_size)
+                except (OSError, ValueError) as e:
+                    self.broken = True
+                    logging.warning(f"Embedding cache disabled, failed to open {self.path}: {e}")
+                    raise
+            else:
+                store = _MemoryStore(self.max_size)
+            self._stores[model_name] = store
+        return store
+
+    def _lookup(self, model_name: str, keys: List[str]):
+        """Return found vectors (copied) and unique keys of missing ones"""
+        _keys = list(dict.fromkeys(keys))  # unique, in order
+        try:
+            with self._lock:
+                found = self._get_store(model_name).get_many(_keys)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Embedding cache lookup failed: {e}")
+            found = {}
+        return found, [key for key in _keys if key not in found]
+
+    def _add(self, model_name: str, keys: List[str], vectors: np.ndarray):
+        if not self.enabled:  # disabled by a failed lookup meanwhile
+            return
+        try:
+            with self._lock:
+                self._get_store(model_name).add(keys, vectors)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Embedding cache add failed: {e}")
+
+    @staticmethod
+    def _output(vectors: np.ndarray, as_array: bool):
+        return vectors if as_array else vectors.tolist()
+
+    def _merge(self, model_name: str, keys, found, missing, vectors, as_array: bool):
+        if missing:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            self._add(model_name, missing, vectors)
+            found.update(zip(missing, vectors))
+        if not keys:
+            return self._output(np.empty((0, 0), dtype=np.float32), as_array)
+        return self._output(np.stack([found[key] for key in keys]), as_array)
+
+    def fetch(self, model_name: str, texts: List[str], embed: Callable, as_array: bool = False):
+        """
+        Get embeddings of texts, call `embed` with missing texts only.
+
+        Args:
+          - model_name: embedding model, part of the cache key
+          - texts: texts to embed
+          - embed: function takes a list of texts and returns a list or matrix of embeddings
+          - as_array: return a float32 matrix instead of lists
+        """
+        if not self.enabled:
+            return self._output(np.asarray(embed(texts), dtype=np.float32), as_array)
+
+        keys = [utils.get_md5(text) for text in texts]
+        found, missing = self._lookup(model_name, keys)
+        _texts = {key: text for key, text in zip(keys, texts)}
+        vectors = embed([_texts[key] for key in missing]) if missing else []
+        return self._merge(model_name, keys, found, missing, vectors, as_array)
+
+    async def afetch(self, model_name: str, texts: List[str], aembed: Callable, as_array: bool = False):
+        """Asynchronous version of `fetch`, `aembed` is a coroutine function"""
+        if not self.enabled:
+            return self._output(np.asarray(await aembed(texts), dtype=np.float32), as_array)
+
+        keys = [utils.get_md5(text) for text in texts]
+        found, missing = await asyncio.to_thread(self._lookup, model_name, keys)  # disk reads
+        _texts = {key: text for key, text in zip(keys, texts)}
+        vectors = await aembed([_texts[key] for key in missing]) if missing else []
+        return await asyncio.to_thread(self._merge, model_name, keys, found, missing, vectors, as_array)
+
+embedding_cache = EmbeddingCache(
+    max_size=settings.EMBEDDING_CACHE_SIZE,
+    path=os.path.join(settings.CACHE_DIR, 'embeddings') if settings.EMBEDDING_CACHE_DISK else None,
+)
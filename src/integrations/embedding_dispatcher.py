@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+
+from runtime import cancel, deadline
+
+class AdaptiveBatchSize():
+    """
+    Sub-batch size of embedding requests, adapted to observed latency and server errors.
+
+    Additive increase after fast full batches, multiplicative decrease:
+      - halve on errors
+      - shrink by a quarter when a request is slower than `target_latency`
+    """
+
+    def __init__(self, max_size: int, target_latency: float, min_size: int = 8):
+        """
+        Args:
+          - max_size: upper limit and initial size
+          - target_latency: seconds, requests slower than this shrink the size
+          - min_size: lower limit
+        """
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.target_latency = target_latency
+        self.size = max_size
+
+        self._lock = threading.Lock()
+
+    def record(self, count: int, seconds: float, ok: bool = True):
+        """Record one request of `count` texts"""
+        with self._lock:
+            if not ok:
+                self.size = max(self.min_size, self.size // 2)
+            elif seconds > self.target_latency:
+                self.size = max(self.min_size, self.size * 3 // 4)
+            elif count >= self.size:
+                self.size = min(self.max_size, self.size + max(1, self.size // 8))
+
+    def split(self, texts: List[str]) -> List[List[str]]:
+        size = self.size
+        return [texts[i:i + size] for i in range(0, len(texts), size)]
+
+class EmbeddingDispatcher():
+    """
+    Micro-batching queue of embedding requests.
+
+    Texts from all callers, threads or the event loop, are collected for a short window
+    and sent in one request of up to `batch_size.size` texts. Results are split back to the callers in order.
+    A caller with more texts is split into multiple requests.
+
+    Batches are sent by a thread pool, so the next batch is collected while requests are in flight.
+    Each batch runs in the context of one of its callers, the one not cancelled with the latest deadline,
+    so the request deadline, cancel token and retry budget apply to it. Callers wait up to their own deadline.
+    """
+
+    def __init__(self, embed: Callable, window: float, batch_size: AdaptiveBatchSize, max_workers: int):
+        """
+        Args:
+          - embed: function takes a list of texts and returns a float32 matrix of embeddings, blocking
+          - window: seconds to wait for more texts after the first one of a batch
+          - batch_size: max texts per request
+          - max_workers: max requests in flight
+        """
+        self.embed = embed
+        self.window = window
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+        self._queue = queue.Queue()  # (texts, future, context of the caller)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._dim = 0  # embedding dimension, known after the first batch
+
+        # stats, updated by the pool threads
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def _start(self):
+        """Start the collecting thread at the first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="embedding")
+                threading.Thread(target=self._worker, name="embedding-dispatcher", daemon=True).start()
+
+    def _put(self, texts: List[str]) -> List[Future]:
+        self._start()
+        futures = []
+        for _texts in self.batch_size.split(texts):
+            future = Future()
+            self._queue.put((_texts, future, contextvars.copy_context()))
+            futures.append(future)
+        return futures
+
+    def _empty(self) -> np.ndarray:
+        return np.empty((0, self._dim), dtype=np.float32)
+
+    def submit(self, texts: List[str]) -> np.ndarray:
+        """Get embeddings of texts, blocking"""
+        if not texts:
+            return self._empty()
+        futures = self._put(texts)
+        try:
+            return np.concatenate([future.result(timeout=deadline.remaining()) for future in futures])
+        except TimeoutError:
+            for future in futures:
+                future.cancel()
+            raise deadline.DeadlineExceeded("Request deadline exceeded waiting for embeddings") from None
+
+    async def asubmit(self, texts: List[str]) -> np.ndarray:
+        """Get embeddings of texts without blocking the event loop"""
+        if not texts:
+            return self._empty()
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*[asyncio.wrap_future(f) for f in self._put(texts)]),
+                deadline.remaining(),
+            )
+        except TimeoutError:
+            raise deadline.DeadlineExceeded("Request deadline exceeded waiting for embeddings") from None
+        return np.concatenate(results)
+
+    def _worker(self):
+        carry = None  # item that did not fit in the previous batch
+        while True:
+            item = carry or self._queue.get()
+            carry = None
+            batch = [item]
+            size = len(item[0])
+            max_size = self.batch_size.size
+            deadline = time.monotonic() + self.window
+            while size < max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if size + len(item[0]) > max_size:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._executor.submit(self._send, batch)
+
+    @staticmethod
+    def _pick_context(batch: list) -> contextvars.Context:
+        """Context of the caller not cancelled with the latest deadline, no deadline counts as latest"""
+        def rank(context):
+            token = context.run(cancel.get_token)
+            at = context.run(deadline.get_deadline)
+            return (token is None or not token.cancelled, float('inf') if at is None else at)
+        return max((context for _, _, context in batch), key=rank)
+
+    def _send(self, batch: list):
+        # skip callers cancelled meanwhile
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for _texts, _, _ in batch for text in _texts]
+        try:
+            embeddings = self._pick_context(batch).run(self.embed, texts)
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Got {len(embeddings)} embeddings for {len(texts)} texts")
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self.batches += 1
+            self.texts += len(texts)
+            if len(embeddings):
+                self._dim = len(embeddings[0])
+        start = 0
+        for _texts, future, _ in batch:
+            future.set_result(embeddings[start:start + len(_texts)])
+            start += len(_texts)
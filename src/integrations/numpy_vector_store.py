@@ -0,0 +1,117 @@
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    In-memory vector store for small per-request indexes.
+
+    Embeddings are normalized once when added and kept in a contiguous float32 matrix,
+    a query is one matrix-vector product plus `argpartition` for top k.
+    Text is kept in the docstore of the index, same as the default simple store.
+
+    Supports the default query mode with optional `node_ids` and `doc_ids` filters, no metadata filters.
+    """
+
+    stores_text: bool = False
+
+    _matrix: Optional[np.ndarray] = PrivateAttr(default=None)  # capacity grows by doubling
+    _size: int = PrivateAttr(default=0)
+    _ids: List[str] = PrivateAttr(default_factory=list)  # row -> node id
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)  # row -> ref doc id
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = self._normalize(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+
+        with self._lock:
+            size = self._size + len(nodes)
+            if self._matrix is None:
+                self._matrix = np.empty((max(size, 256), vectors.shape[1]), dtype=np.float32)
+            elif size > len(self._matrix):
+                _matrix = np.empty((max(size, len(self._matrix) * 2), self._matrix.shape[1]), dtype=np.float32)
+                _matrix[:self._size] = self._matrix[:self._size]
+                self._matrix = _matrix
+            self._matrix[self._size:size] = vectors
+            self._size = size
+            self._ids.extend(node.node_id for node in nodes)
+            self._ref_doc_ids.extend(node.ref_doc_id for node in nodes)
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            keep = [row for row, _id in enumerate(self._ref_doc_ids) if _id != ref_doc_id]
+            if len(keep) == self._size:
+                return
+            self._matrix[:len(keep)] = self._matrix[keep]
+            self._ids = [self._ids[row] for row in keep]
+            self._ref_doc_ids = [self._ref_doc_ids[row] for row in keep]
+            self._size = len(keep)
+
+    def _get_rows(self, query: VectorStoreQuery) -> Optional[np.ndarray]:
+        """Rows allowed by the query filters, None for all"""
+        if query.filters is not None:
+            raise ValueError("Metadata filters not supported by NumpyVectorStore")
+        if query.node_ids is None and query.doc_ids is None:
+            return None
+        node_ids = set(query.node_ids or [])
+        doc_ids = set(query.doc_ids or [])
+        return np.array([
+            row for row in range(self._size)
+            if (query.node_ids is None or self._ids[row] in node_ids)
+            and (query.doc_ids is None or self._ref_doc_ids[row] in doc_ids)
+        ], dtype=np.int64)
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indexes of the top k scores along the last axis, in descending order"""
+        if scores.shape[-1] > k:
+            top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape).copy()
+        order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1)
+        return np.take_along_axis(top, order, axis=-1)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Query mode {query.mode} not supported by NumpyVectorStore")
+        if query.query_embedding is None:
+            raise ValueError("Query embedding is required")
+
+        with self._lock:
+            if not self._size:  # nothing added, e.g. a source without text
+                return VectorStoreQueryResult(similarities=[], ids=[])
+            rows = self._get_rows(query)
+            matrix = self._matrix[:self._size] if rows is None else self._matrix[rows]
+            ids = self._ids if rows is None else [self._ids[row] for row in rows]
+        if not len(ids) or query.similarity_top_k < 1:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        vector = self._normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        scores = matrix @ vector
+        top = self._top_k(scores, query.similarity_top_k)
+        return VectorStoreQueryResult(similarities=scores[top].tolist(), ids=[ids[i] for i in top])
@@ -1,14 +1,19 @@
 # reference: https://github.com/ollama/ollama-python/blob/main/ollama/_client.py
 
+import asyncio
 import os
+import time
 import httpx
+import numpy as np
 from typing import Any, List
 from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.bridge.pydantic import PrivateAttr
-from tenacity import retry, stop_after_attempt, wait_fixed
 
-import utils
 from _types import ResponseError
+from runtime import retries, scheduler, transport
+from settings import settings
+from .embedding_cache import embedding_cache
+from .embedding_dispatcher import AdaptiveBatchSize, EmbeddingDispatcher
 
 DEFAULT_OLLAMA_BASE_URL = "http://localhost:11434"
 
@@ -16,6 +21,10 @@ class OllamaEmbedding(BaseEmbedding):
     """Class for Ollama embeddings.
 
     Using retry here cause one failed request could crash the whole embedding process.
+    Connections come from the shared pool of the `embedding` upstream.
+    Embeddings are cached, only texts not embedded before are sent to the server.
+    Texts of concurrent callers are batched by the dispatcher into shared requests.
+    Async calls split texts into sub-batches sent concurrently, the sub-batch size adapts to latency and errors.
 
     Args:
         api_key (str): Server API key.
@@ -23,8 +32,8 @@ class OllamaEmbedding(BaseEmbedding):
         base_url (str): Ollama url. Defaults to http://localhost:7997.
     """
 
-    _aclient: httpx.AsyncClient = PrivateAttr()
-    _client: httpx.Client = PrivateAttr()
+    _batch_size: AdaptiveBatchSize = PrivateAttr()
+    _dispatcher: EmbeddingDispatcher = PrivateAttr()
     _settings: dict = PrivateAttr()
     _url: str = PrivateAttr()
 
@@ -33,8 +42,6 @@ class OllamaEmbedding(BaseEmbedding):
         model_name: str,
         api_key: str = "key",
         base_url: str = DEFAULT_OLLAMA_BASE_URL,
-        http2: bool = True,
-        follow_redirects: bool = True,
         timeout: Any = None,
         **kwargs: Any,
     ) -> None:
@@ -44,49 +51,73 @@ class OllamaEmbedding(BaseEmbedding):
         )
 
         self._settings = {
-            'follow_redirects': follow_redirects,
             'headers': {
                 'Content-Type': 'application/json',
                 'Accept': 'application/json',
                 'Authorization': f"Bearer {api_key}",
             },
-            'http2': http2,
             'timeout': timeout,
         }
 
         self._url = os.path.join(base_url, "api/embed")
 
+        self._batch_size = AdaptiveBatchSize(
+            max_size=self.embed_batch_size,
+            target_latency=settings.EMBEDDING_TARGET_LATENCY / 1000,
+        )
+        self._dispatcher = EmbeddingDispatcher(
+            self._embed,
+            window=settings.EMBEDDING_BATCH_WINDOW / 1000,
+            batch_size=self._batch_size,
+            max_workers=settings.CONCURRENCY_EMBEDDING,
+        )
+
     @classmethod
     def class_name(cls) -> str:
         return "OllamaEmbedding"
 
     def _get_client(self, _async: bool = False):
-        """Set and return httpx sync or async client"""
+        """Get the shared httpx sync or async client of the `embedding` upstream"""
         if _async:
-            if not hasattr(self, "_aclient"):
-                self._aclient = httpx.AsyncClient(**self._settings)
-            return self._aclient
-        else:
-            if not hasattr(self, "_client"):
-                self._client = httpx.Client(**self._settings)
-            return self._client
+            return transport.aclient('embedding')
+        return transport.client('embedding')
     
-    def _process_response(self, response: httpx.Response) -> List[List[float]]:
-        embeddings = response.json()['embeddings']
-        return embeddings
+    def _process_response(self, response: httpx.Response) -> np.ndarray:
+        return np.asarray(response.json()['embeddings'], dtype=np.float32)
+
+    def get_text_embedding_array(self, texts: List[str]) -> np.ndarray:
+        """Get text embeddings as a float32 matrix, without conversion to Python lists."""
+        return embedding_cache.fetch(self.model_name, texts, self._dispatcher.submit, as_array=True)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(0.5), before_sleep=utils.retry_log_warning, reraise=True)
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Get text embeddings."""
+        return embedding_cache.fetch(self.model_name, texts, self._dispatcher.submit)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Asynchronously get text embeddings."""
+        return await embedding_cache.afetch(self.model_name, texts, self._aembed_batches)
+
+    @retries.policy('embedding')
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Get text embeddings from server."""
         client = self._get_client()
-        response = client.request(
-            'POST',
-            self._url,
-            json={
-                "input": texts, 
-                "model": self.model_name,
-            },
-        )
+        with scheduler.slot('embedding'):
+            start = time.monotonic()
+            try:
+                response = client.request(
+                    'POST',
+                    self._url,
+                    headers=self._settings['headers'],
+                    timeout=self._settings['timeout'],
+                    json={
+                        "input": texts, 
+                        "model": self.model_name,
+                    },
+                )
+            except httpx.TransportError:
+                self._batch_size.record(len(texts), time.monotonic() - start, ok=False)
+                raise
+        self._record(len(texts), start, response)
     
         try:
           response.raise_for_status()
@@ -96,18 +127,27 @@ class OllamaEmbedding(BaseEmbedding):
         return self._process_response(response)
 
     # TODO: debug `Event loop is closed`
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(0.5), before_sleep=utils.retry_log_warning, reraise=True)   
-    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Asynchronously get text embeddings."""
+    @retries.policy('embedding')
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        """Asynchronously get text embeddings from server."""
         client = self._get_client(_async=True)
-        response = await client.request(
-            'POST',
-            self._url,
-            json={
-                "input": texts, 
-                "model": self.model_name,
-            },
-        )
+        async with scheduler.slot('embedding'):
+            start = time.monotonic()
+            try:
+                response = await client.request(
+                    'POST',
+                    self._url,
+                    headers=self._settings['headers'],
+                    timeout=self._settings['timeout'],
+                    json={
+                        "input": texts, 
+                        "model": self.model_name,
+                    },
+                )
+            except httpx.TransportError:
+                self._batch_size.record(len(texts), time.monotonic() - start, ok=False)
+                raise
+        self._record(len(texts), start, response)
     
         try:
           response.raise_for_status()
@@ -116,13 +156,23 @@ class OllamaEmbedding(BaseEmbedding):
     
         return self._process_response(response)
 
+    def _record(self, count: int, start: float, response: httpx.Response):
+        """Feed request latency and status to the adaptive sub-batch size"""
+        ok = not response.is_server_error and response.status_code != 413
+        self._batch_size.record(count, time.monotonic() - start, ok=ok)
+
+    async def _aembed_batches(self, texts: List[str]) -> np.ndarray:
+        """Split texts into sub-batches and send concurrently, within the `embedding` stage concurrency limit"""
+        results = await asyncio.gather(*[self._aembed(_texts) for _texts in self._batch_size.split(texts)])
+        return np.concatenate(results)
+
     def _get_query_embedding(self, query: str) -> List[float]:
         """Get query embedding."""
         return self._get_text_embeddings([query])[0]
 
     async def _aget_query_embedding(self, query: str) -> List[float]:
         """The asynchronous version of _get_query_embedding."""
-        return await self._aget_text_embeddings([query])[0]
+        return (await self._aget_text_embeddings([query]))[0]
 
     def _get_text_embedding(self, text: str) -> List[float]:
         """Get text embedding."""
@@ -130,4 +180,4 @@ class OllamaEmbedding(BaseEmbedding):
 
     async def _aget_text_embedding(self, text: str) -> List[float]:
         """Asynchronously get text embedding."""
-        return await self._aget_text_embeddings([text])[0]
\ No newline at end of file
+        return (await self._aget_text_embeddings([text]))[0]
\ No newline at end of file
@@ -0,0 +1,4 @@
+__all__ = ['JobStore', 'JobWorker', 'MemoryJobStore', 'RedisJobStore', 'SQLiteJobStore', 'get_job_store', 'job_store', 'job_worker']
+
+from .store import JobStore, MemoryJobStore, RedisJobStore, SQLiteJobStore, get_job_store, job_store
+from .worker import JobWorker, job_worker
@@ -0,0 +1,29 @@
+"""
+Run a job worker process without the web tier, from the `src` directory:
+    python -m jobs
+"""
+
+import asyncio
+import logging
+
+from modules.rerank import rerank_service
+from runtime import transport
+from .worker import job_worker
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+async def main():
+    transport.start()  # outbound HTTP connection pools
+    await asyncio.to_thread(rerank_service.load)  # load rerank model files before taking jobs
+    job_worker.concurrency = job_worker.concurrency or 1
+    job_worker.start()
+    try:
+        await asyncio.Event().wait()  # run until stopped
+    finally:
+        await job_worker.stop()
+        await transport.aclose()
+
+asyncio.run(main())
@@ -0,0 +1,512 @@
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Optional
+
+from settings import settings
+
+class JobStore(abc.ABC):
+    """
+    Queue and result store of check jobs, shared by the web tier and workers.
+
+    Job status:
+      - queued: waiting for a worker
+      - running: taken by a worker, back to the queue if the worker stops renewing its lease
+      - done: result is the final report
+      - failed: error contains the reason
+
+    Each take starts a new lease with its own `lease_id`. Writes of the worker (renew, add_event, finish)
+    only apply while it still owns the lease, so a worker with an expired lease can not overwrite
+    the new owner. Events of a job are cleared when it is requeued, the new owner starts over.
+
+    Operations map to Redis primitives so stores can be swapped:
+      - queue: list push and pop
+      - job record: hash of status, payload, result, lease ID
+      - events: list appended by the worker and read from an offset by subscribers
+      - leases: sorted set of running jobs by lease expiry
+
+    Calls do blocking I/O, run them in the threadpool from async code.
+    """
+
+    @abc.abstractmethod
+    def create(self, payload: dict) -> str:
+        """Add a job to the queue, return its ID"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def take(self, lease: float) -> Optional[dict]:
+        """Take the next queued job for `lease` seconds, None if the queue is empty. The job has an extra key `lease_id`"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def renew(self, job_id: str, lease_id: str, lease: float) -> bool:
+        """Extend the lease of a running job, False if the lease is lost"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_event(self, job_id: str, lease_id: str, event: dict) -> bool:
+        """Append an event of a running job, False if the lease is lost"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_events(self, job_id: str, start: int = 0) -> list:
+        """Events of the job from offset `start`"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def finish(self, job_id: str, lease_id: str, result=None, error: str = None) -> bool:
+        """Set the job done with result, or failed with error, False if the lease is lost"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[dict]:
+        """Job record with keys: id, status, payload, result, error, created, updated, None if missing"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def queue_length(self) -> int:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def cleanup(self, ttl: float):
+        """Remove jobs finished more than `ttl` seconds ago"""
+        raise NotImplementedError
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+class MemoryJobStore(JobStore):
+    """Job store in process memory, for a single process running both the web tier and workers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}  # ID -> job record
+        self._events = {}  # ID -> list of events
+        self._queue = deque()
+        self._leases = {}  # ID -> (lease ID, lease expiry)
+
+    def _reclaim(self, now: float):
+        """Requeue running jobs with expired lease"""
+        for job_id, (_, until) in list(self._leases.items()):
+            if until < now:
+                del self._leases[job_id]
+                self._jobs[job_id]['status'] = 'queued'
+                self._events[job_id] = []
+                self._queue.append(job_id)
+                logging.warning(f"Job lease expired, requeue: {job_id}")
+
+    def _owns(self, job_id: str, lease_id: str) -> bool:
+        lease = self._leases.get(job_id)
+        return lease is not None and lease[0] == lease_id
+
+    def create(self, payload: dict) -> str:
+        job_id = self.new_id()
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {'id': job_id, 'status': 'queued', 'payload': payload, 'result': None, 'error': None, 'created': now, 'updated': now}
+            self._events[job_id] = []
+            self._queue.append(job_id)
+        return job_id
+
+    def take(self, lease: float) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            self._reclaim(now)
+            while self._queue:
+                job = self._jobs.get(self._queue.popleft())
+                if job is None or job['status'] != 'queued':
+                    continue
+                job.update(status='running', updated=now)
+                lease_id = self.new_id()
+                self._leases[job['id']] = (lease_id, now + lease)
+                return {**job, 'lease_id': lease_id}
+        return None
+
+    def renew(self, job_id: str, lease_id: str, lease: float) -> bool:
+        with self._lock:
+            if not self._owns(job_id, lease_id):
+                return False
+            self._leases[job_id] = (lease_id, time.time() + lease)
+            return True
+
+    def add_event(self, job_id: str, lease_id: str, event: dict) -> bool:
+        with self._lock:
+            if not self._owns(job_id, lease_id):
+                return False
+            self._events[job_id].append(event)
+            return True
+
+    def get_events(self, job_id: str, start: int = 0) -> list:
+        with self._lock:
+            return list(self._events.get(job_id, [])[start:])
+
+    def finish(self, job_id: str, lease_id: str, result=None, error: str = None) -> bool:
+        with self._lock:
+            if not self._owns(job_id, lease_id):
+                return False
+            del self._leases[job_id]
+            self._jobs[job_id].update(status='failed' if error else 'done', result=result, error=error, updated=time.time())
+            return True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def queue_length(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def cleanup(self, ttl: float):
+        expired = time.time() - ttl
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job['status'] in ('done', 'failed') and job['updated'] < expired:
+                    del self._jobs[job_id]
+                    del self._events[job_id]
+
+class SQLiteJobStore(JobStore):
+    """
+    Job store in SQLite, shared by worker processes on the same host.
+    Same connection handling as `VerdictCache`.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+          - path: SQLite file path, parent directory will be created if not exists
+        """
+        self.path = path
+
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _get_conn(self):
+        """Connect and create tables at the first use, avoid I/O at import"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+                "created REAL NOT NULL, updated REAL NOT NULL, lease REAL, lease_id TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                "id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (id, seq))"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _row(row) -> dict:
+        job_id, status, payload, result, error, created, updated = row
+        return {
+            'id': job_id,
+            'status': status,
+            'payload': json.loads(payload),
+            'result': json.loads(result) if result is not None else None,
+            'error': error,
+            'created': created,
+            'updated': updated,
+        }
+
+    def create(self, payload: dict) -> str:
+        job_id = self.new_id()
+        now = time.time()
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, created, updated) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(payload), now, now),
+            )
+            conn.commit()
+        return job_id
+
+    def take(self, lease: float) -> Optional[dict]:
+        now = time.time()
+        lease_id = self.new_id()
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")  # lock against other processes between select and update
+            try:
+                conn.execute(
+                    "DELETE FROM job_events WHERE id IN (SELECT id FROM jobs WHERE status = 'running' AND lease < ?)", (now,)
+                )
+                reclaimed = conn.execute(
+                    "UPDATE jobs SET status = 'queued', lease = NULL, lease_id = NULL WHERE status = 'running' AND lease < ?", (now,)
+                ).rowcount
+                if reclaimed:
+                    logging.warning(f"Job lease expired, requeue {reclaimed} jobs")
+                row = conn.execute(
+                    "SELECT id, status, payload, result, error, created, updated FROM jobs "
+                    "WHERE status = 'queued' ORDER BY created LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', updated = ?, lease = ?, lease_id = ? WHERE id = ?",
+                        (now, now + lease, lease_id, row[0]),
+                    )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        if row is None:
+            return None
+        return {**self._row(row), 'status': 'running', 'updated': now, 'lease_id': lease_id}
+
+    def renew(self, job_id: str, lease_id: str, lease: float) -> bool:
+        with self._lock:
+            conn = self._get_conn()
+            renewed = conn.execute(
+                "UPDATE jobs SET lease = ? WHERE id = ? AND lease_id = ? AND status = 'running'",
+                (time.time() + lease, job_id, lease_id),
+            ).rowcount
+            conn.commit()
+        return renewed > 0
+
+    def add_event(self, job_id: str, lease_id: str, event: dict) -> bool:
+        with self._lock:
+            conn = self._get_conn()
+            added = conn.execute(
+                "INSERT INTO job_events (id, seq, event) "
+                "SELECT id, (SELECT COALESCE(MAX(seq) + 1, 0) FROM job_events WHERE id = ?), ? "
+                "FROM jobs WHERE id = ? AND lease_id = ? AND status = 'running'",
+                (job_id, json.dumps(event), job_id, lease_id),
+            ).rowcount
+            conn.commit()
+        return added > 0
+
+    def get_events(self, job_id: str, start: int = 0) -> list:
+        with self._lock:
+            rows = self._get_conn().execute(
+                "SELECT event FROM job_events WHERE id = ? AND seq >= ? ORDER BY seq", (job_id, start)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def finish(self, job_id: str, lease_id: str, result=None, error: str = None) -> bool:
+        with self._lock:
+            conn = self._get_conn()
+            finished = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ?, lease = NULL, lease_id = NULL "
+                "WHERE id = ? AND lease_id = ? AND status = 'running'",
+                ('failed' if error else 'done', json.dumps(result), error, time.time(), job_id, lease_id),
+            ).rowcount
+            conn.commit()
+        return finished > 0
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._get_conn().execute(
+                "SELECT id, status, payload, result, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row(row) if row else None
+
+    def queue_length(self) -> int:
+        with self._lock:
+            return self._get_conn().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def cleanup(self, ttl: float):
+        expired = time.time() - ttl
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute(
+                "DELETE FROM job_events WHERE id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated < ?)",
+                (expired,),
+            )
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (expired,))
+            conn.commit()
+
+# Redis scripts, each runs atomically so a worker dying between steps can not lose a job.
+# Job and event keys are built from the prefix in ARGV, keep all keys on one node if clustered.
+
+# KEYS: queue, leases. ARGV: prefix, now, lease expiry, lease ID. Returns [job ID or '', jobs requeued]
+_REDIS_TAKE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+for _, id in ipairs(expired) do
+  redis.call('ZREM', KEYS[2], id)
+  redis.call('HSET', ARGV[1] .. 'job:' .. id, 'status', 'queued', 'lease_id', '')
+  redis.call('DEL', ARGV[1] .. 'events:' .. id)
+  redis.call('LPUSH', KEYS[1], id)
+end
+while true do
+  local id = redis.call('RPOP', KEYS[1])
+  if not id then
+    return {'', #expired}
+  end
+  if redis.call('EXISTS', ARGV[1] .. 'job:' .. id) == 1 then
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+    redis.call('HSET', ARGV[1] .. 'job:' .. id, 'status', 'running', 'updated', ARGV[2], 'lease_id', ARGV[4])
+    return {id, #expired}
+  end
+end
+"""
+
+# KEYS: leases, job. ARGV: job ID, lease ID, lease expiry. Returns 1 if renewed
+_REDIS_RENEW = """
+if redis.call('HGET', KEYS[2], 'lease_id') ~= ARGV[2] or not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+  return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+# KEYS: job, events. ARGV: lease ID, event. Returns 1 if added
+_REDIS_ADD_EVENT = """
+if redis.call('HGET', KEYS[1], 'lease_id') ~= ARGV[1] then
+  return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[2])
+return 1
+"""
+
+# KEYS: leases, job, events. ARGV: job ID, lease ID, status, result, error, now, ttl. Returns 1 if finished
+_REDIS_FINISH = """
+if redis.call('HGET', KEYS[2], 'lease_id') ~= ARGV[2] then
+  return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], 'status', ARGV[3], 'result', ARGV[4], 'error', ARGV[5], 'updated', ARGV[6], 'lease_id', '')
+redis.call('EXPIRE', KEYS[2], ARGV[7])
+redis.call('EXPIRE', KEYS[3], ARGV[7])
+return 1
+"""
+
+class RedisJobStore(JobStore):
+    """
+    Job store in Redis, shared by workers on multiple nodes.
+
+    Takes a client with the redis-py API, e.g. `redis.Redis`, or connects to `url` with redis-py (optional dependency).
+    Keys, with `prefix`:
+      - queue: list of queued job IDs
+      - leases: sorted set of running job IDs by lease expiry
+      - job:{id}: hash of the job record
+      - events:{id}: list of events
+    Finished jobs expire after `ttl` seconds. Take, renew, add event and finish run as Lua scripts.
+    """
+
+    def __init__(self, url: str = None, client=None, prefix: str = "check:", ttl: int = 86400):
+        """
+        Args:
+          - url: Redis URL, used if no client
+          - client: redis-py compatible client, `decode_responses` not required
+          - prefix: key prefix
+          - ttl: seconds to keep finished jobs
+        """
+        self.url = url
+        self.prefix = prefix
+        self.ttl = ttl
+        self._client = client
+        self._scripts = {}
+
+    def _get_client(self):
+        """Connect at the first use, avoid I/O at import"""
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def _script(self, name: str, source: str):
+        """Registered script, loaded to Redis at the first call"""
+        if name not in self._scripts:
+            self._scripts[name] = self._get_client().register_script(source)
+        return self._scripts[name]
+
+    def _key(self, *parts) -> str:
+        return self.prefix + ':'.join(parts)
+
+    @staticmethod
+    def _str(value) -> Optional[str]:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def create(self, payload: dict) -> str:
+        job_id = self.new_id()
+        now = time.time()
+        client = self._get_client()
+        client.hset(self._key('job', job_id), mapping={
+            'status': 'queued', 'payload': json.dumps(payload), 'created': now, 'updated': now,
+        })
+        client.lpush(self._key('queue'), job_id)
+        return job_id
+
+    def take(self, lease: float) -> Optional[dict]:
+        now = time.time()
+        lease_id = self.new_id()
+        job_id, reclaimed = self._script('take', _REDIS_TAKE)(
+            keys=[self._key('queue'), self._key('leases')],
+            args=[self.prefix, now, now + lease, lease_id],
+        )
+        if reclaimed:
+            logging.warning(f"Job lease expired, requeue {reclaimed} jobs")
+        job_id = self._str(job_id)
+        if not job_id:
+            return None
+        job = self.get(job_id)
+        if job is None:  # expired meanwhile
+            return None
+        return {**job, 'lease_id': lease_id}
+
+    def renew(self, job_id: str, lease_id: str, lease: float) -> bool:
+        return bool(self._script('renew', _REDIS_RENEW)(
+            keys=[self._key('leases'), self._key('job', job_id)],
+            args=[job_id, lease_id, time.time() + lease],
+        ))
+
+    def add_event(self, job_id: str, lease_id: str, event: dict) -> bool:
+        return bool(self._script('add_event', _REDIS_ADD_EVENT)(
+            keys=[self._key('job', job_id), self._key('events', job_id)],
+            args=[lease_id, json.dumps(event)],
+        ))
+
+    def get_events(self, job_id: str, start: int = 0) -> list:
+        return [json.loads(v) for v in self._get_client().lrange(self._key('events', job_id), start, -1)]
+
+    def finish(self, job_id: str, lease_id: str, result=None, error: str = None) -> bool:
+        return bool(self._script('finish', _REDIS_FINISH)(
+            keys=[self._key('leases'), self._key('job', job_id), self._key('events', job_id)],
+            args=[job_id, lease_id, 'failed' if error else 'done', json.dumps(result), error or '', time.time(), self.ttl],
+        ))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        data = self._get_client().hgetall(self._key('job', job_id))
+        if not data:
+            return None
+        data = {self._str(k): self._str(v) for k, v in data.items()}
+        return {
+            'id': job_id,
+            'status': data['status'],
+            'payload': json.loads(data['payload']),
+            'result': json.loads(data['result']) if data.get('result') else None,
+            'error': data.get('error') or None,
+            'created': float(data['created']),
+            'updated': float(data['updated']),
+        }
+
+    def queue_length(self) -> int:
+        return self._get_client().llen(self._key('queue'))
+
+    def cleanup(self, ttl: float):
+        """Finished jobs expire by Redis TTL"""
+
+def get_job_store(store: str) -> JobStore:
+    """
+    Args:
+      - store: memory | sqlite | redis
+    """
+    if store == "memory":
+        return MemoryJobStore()
+    if store == "redis":
+        return RedisJobStore(url=settings.JOB_STORE_URL, ttl=settings.JOB_TTL)
+    return SQLiteJobStore(path=os.path.join(settings.CACHE_DIR, 'jobs.sqlite'))
+
+job_store = get_job_store(settings.JOB_STORE)
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+import pipeline
+from runtime import AdmissionController, Overloaded, admission
+from settings import settings
+from .store import JobStore, job_store
+
+class JobWorker():
+    """
+    Run check jobs from the job store, in the web process or a separate worker process.
+
+    Each of the `concurrency` loops takes one job at a time. Leases of running jobs are renewed
+    every third of `lease`, jobs of a stopped worker go back to the queue once their lease expires.
+    A job whose lease is lost, e.g. the worker stalled past it, is stopped and its result dropped.
+
+    Store calls run in the threadpool, stage events are written in order by one writer task per job.
+    Checks of jobs pass admission control of the process after interactive checks, and wait while overloaded.
+    """
+
+    def __init__(self, store: JobStore, concurrency: int, lease: float, poll_interval: float, time_out: float, ttl: float, admission: AdmissionController = admission):
+        """
+        Args:
+          - store: job queue and result store
+          - concurrency: jobs running at once
+          - lease: seconds a job is taken for without renewal
+          - poll_interval: seconds to wait when the queue is empty
+          - time_out: seconds, deadline of each check
+          - ttl: seconds to keep finished jobs
+          - admission: admission control shared with interactive checks
+        """
+        self.store = store
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.time_out = time_out
+        self.ttl = ttl
+        self.admission = admission
+
+        self._tasks = []
+        self._running = {}  # job ID -> (lease ID, check task)
+        self._lost = set()  # job IDs of running jobs whose lease is lost
+
+        # stats
+        self.done = 0
+        self.failed = 0
+        self.lost = 0  # jobs taken over by another worker after the lease expired
+
+    def start(self):
+        """Start worker loops on the running event loop"""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+        logging.info(f"Job worker started, concurrency: {self.concurrency}")
+
+    async def stop(self):
+        """Stop worker loops, running jobs are requeued after their lease expires"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self):
+        while True:
+            try:
+                job = await run_in_threadpool(self.store.take, self.lease)
+            except Exception as e:
+                logging.warning(f"Failed to take job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._run(job)
+
+    async def _write_events(self, job_id: str, lease_id: str, events: asyncio.Queue):
+        """Write stage events to the store in order until None"""
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            try:
+                await run_in_threadpool(self.store.add_event, job_id, lease_id, event)
+            except Exception as e:
+                logging.warning(f"Failed to add job event: {job_id}, {e}")
+
+    async def _check(self, payload: dict, on_event):
+        """Run the check of a job once admitted, the deadline starts after admission"""
+        while True:
+            try:
+                ticket = await self.admission.admit(priority=2)  # after interactive checks
+                break
+            except Overloaded as e:
+                await asyncio.sleep(e.retry_after)
+        try:
+            check = pipeline.Check(
+                input=payload['input'],
+                format=payload.get('format', 'markdown'),
+                use_cache=payload.get('use_cache', True),
+                on_event=on_event,
+                deadline=time.monotonic() + self.time_out,
+            )
+            return await check.final()
+        finally:
+            ticket.release()
+
+    async def _run(self, job: dict):
+        job_id = job['id']
+        lease_id = job['lease_id']
+        payload = job['payload']
+        logging.info(f"Job started: {job_id}")
+        events = asyncio.Queue()
+        writer = asyncio.create_task(self._write_events(job_id, lease_id, events))
+        try:
+            task = asyncio.create_task(self._check(payload, events.put_nowait))
+            self._running[job_id] = (lease_id, task)
+            result = await task
+        except asyncio.CancelledError:
+            writer.cancel()
+            if job_id not in self._lost:
+                raise
+            self.lost += 1
+            logging.warning(f"Job lease lost, stopped: {job_id}")
+            return
+        except HTTPException as e:
+            error = e.detail
+        except Exception as e:
+            logging.error(f"Job failed: {job_id}, {e}")
+            error = "Check failed"  # avoid inner error message expose to public
+        else:
+            error = None
+        finally:
+            self._running.pop(job_id, None)
+            self._lost.discard(job_id)
+
+        events.put_nowait(None)
+        await writer  # events before the final report
+        try:
+            if error is None:
+                finished = await run_in_threadpool(self.store.finish, job_id, lease_id, result=result)
+            else:
+                finished = await run_in_threadpool(self.store.finish, job_id, lease_id, error=error)
+        except Exception as e:
+            logging.warning(f"Failed to finish job: {job_id}, {e}")  # requeued after the lease expires
+            return
+        if not finished:
+            self.lost += 1
+            logging.warning(f"Job lease lost, result dropped: {job_id}")
+        elif error is None:
+            self.done += 1
+        else:
+            self.failed += 1
+
+    async def _maintain(self):
+        """Renew leases of running jobs, stop the jobs whose lease is lost, remove expired jobs from time to time"""
+        interval = self.lease / 3
+        last_cleanup = 0
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for job_id, (lease_id, task) in list(self._running.items()):
+                    if not await run_in_threadpool(self.store.renew, job_id, lease_id, self.lease):
+                        self._lost.add(job_id)
+                        task.cancel()
+                if time.monotonic() - last_cleanup > 3600:
+                    await run_in_threadpool(self.store.cleanup, self.ttl)
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                logging.warning(f"Job worker maintenance failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self.concurrency if self._tasks else 0,
+            'running': len(self._running),
+            'done': self.done,
+            'failed': self.failed,
+            'lost': self.lost,
+        }
+
+job_worker = JobWorker(
+    store=job_store,
+    concurrency=settings.JOB_WORKERS,
+    lease=settings.JOB_LEASE,
+    poll_interval=settings.JOB_POLL_INTERVAL / 1000,
+    time_out=settings.JOB_TIME_OUT,
+    ttl=settings.JOB_TTL,
+)
@@ -1,11 +1,19 @@
 import asyncio
 import logging
+import time
+import weakref
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel
 
 import pipeline
 import utils
 import web
+from jobs import job_store, job_worker
+from modules.lm import prompt_batcher
+from modules.rerank import rerank_service
+from runtime import Overloaded, SingleFlight, admission, hedger, read_governor, retries, scheduler, transport
 from settings import settings
 
 logging.basicConfig(
@@ -16,30 +24,101 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# coalesce identical checks in flight, cancel the ones abandoned by all clients
+checks = SingleFlight(cancel_grace=settings.DISCONNECT_GRACE if settings.DISCONNECT_CANCEL else None)
 
-# TODO: multi-stage response
-async def stream_response(input: str, format: str):
-    pipeline_check = pipeline.Check(input=input, format=format)
-    task = asyncio.create_task(pipeline_check.final())
-    
-    # Stream response to prevent timeout, return multi-stage responses
-    elapsed_time = 0
-    _check_interval = 0.2
-    while not task.done():
-        if elapsed_time > settings.STREAM_TIME_OUT:  # waiting timeout
-            raise Exception(f"Waiting fact check results reached time limit: {settings.STREAM_TIME_OUT} seconds")
-        if elapsed_time % 30 == 0:  # return wait messages from time to time
-            yield utils.get_stream(stage='processing', content='processing ...')
-        await asyncio.sleep(_check_interval)
-        elapsed_time = round(elapsed_time + _check_interval, 1)
-    
-    result = await task
-    yield utils.get_stream(stage='final', content=result)
+
+async def stream_response(input: str, format: str, use_cache: bool = True, request: Request = None, ticket=None, priority: float = 0):
+    """
+    Stream stage events as the pipeline publishes them, then the final report.
+
+    Identical checks (same normalized input, format and cache use) share one pipeline,
+    the first request starts it and the others subscribe to its events and result.
+    Once all clients disconnected, the pipeline is cancelled after `DISCONNECT_GRACE` seconds
+    unless at least `DISCONNECT_KEEP_PROGRESS` of its statements are done.
+    The admission `ticket` is held until the pipeline ends, which may outlive this stream.
+    Without a ticket, because the check was in flight when the request came in, one is taken at `priority`
+    if that check ended before this stream started.
+
+    The pipeline deadline is `DEADLINE_RESERVE` seconds ahead of the stream time limit,
+    so statements not finished by then still get a partial summary in the final report.
+    """
+    key = (checks.normalize(input), format, use_cache)
+    _deadline = time.monotonic() + float(settings.STREAM_TIME_OUT) - settings.DEADLINE_RESERVE
+    _check = {}
+
+    def _start(publish):
+        _check['check'] = pipeline.Check(input=input, format=format, use_cache=use_cache, on_event=publish, deadline=_deadline)
+        return _check['check'].final()
+
+    leader = not checks.in_flight(key)
+    if leader and ticket is None:  # the check joined at request time ended meanwhile
+        try:
+            ticket = await admission.admit(priority=priority)
+        except Overloaded as e:
+            yield utils.get_stream(stage='error', content=f"Service overloaded, please retry after {e.retry_after} seconds")
+            return
+        leader = not checks.in_flight(key)  # started by another request while waiting
+    flight = checks.join(key, _start, keep=lambda: _check['check'].progress() >= settings.DISCONNECT_KEEP_PROGRESS)
+    queue = flight.subscribe()
+    if ticket is not None:
+        if leader:
+            ticket.attach(flight.task)  # count the check until it ends, it may outlive this stream
+        else:
+            ticket.release()  # joined a check admitted meanwhile by another request
+
+    try:
+        yield utils.get_stream(stage='processing', content='processing ...')
+
+        # Stream events, return wait messages from time to time to prevent timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + float(settings.STREAM_TIME_OUT)
+        _heartbeat_interval = 30
+        _disconnect_interval = 1  # check client connection while no events
+        heartbeat = loop.time() + _heartbeat_interval
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:  # waiting timeout
+                raise Exception(f"Waiting fact check results reached time limit: {settings.STREAM_TIME_OUT} seconds")
+            timeout = min(heartbeat - loop.time(), remaining)
+            if request is not None:
+                timeout = min(timeout, _disconnect_interval)
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                if request is not None and await request.is_disconnected():
+                    logger.info("Client disconnected, stop streaming")
+                    return
+                if loop.time() >= heartbeat:
+                    yield utils.get_stream(stage='processing', content='processing ...')
+                    heartbeat = loop.time() + _heartbeat_interval
+                continue
+            if event is None:  # pipeline done
+                break
+            yield utils.get_stream(stage=event['stage'], content=event['content'])
+            heartbeat = loop.time() + _heartbeat_interval
+
+        # shield the shared task from cancellation of this subscriber
+        result = await asyncio.shield(flight.task)
+        yield utils.get_stream(stage='final', content=result)
+    finally:
+        flight.leave(queue)
+        if ticket is not None:
+            ticket.release()
 
 
 @app.on_event("startup")
 async def startup_event():
-    pass
+    transport.start()  # outbound HTTP connection pools
+    await run_in_threadpool(rerank_service.load)  # load rerank model files at app start
+    if settings.JOB_WORKERS:
+        job_worker.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_worker.stop()
+    await transport.aclose()
 
 
 """Redirect /doc to /docs"""
@@ -50,21 +129,130 @@ async def _doc_redirect():
 
 @app.get("/health")
 async def health():
+    """Readiness for load balancers, 503 while overloaded"""
+    _ready = admission.ready()
+    if not _ready['ready']:
+        return JSONResponse(status_code=503, content={"status": "overloaded", "reasons": _ready['reasons']})
     return {"status": "ok"}
 
 
 @app.get("/status")
 async def status():
     _status = utils.get_status()
+    _status['coalescing'] = checks.stats()
+    _status['stages'] = scheduler.stats()
+    _status['llm_batch'] = prompt_batcher.stats()
+    _status['rerank'] = rerank_service.stats()
+    _status['http'] = transport.stats()
+    _status['read_hosts'] = read_governor.stats()
+    _status['hedging'] = hedger.stats()
+    _status['retries'] = retries.stats()
+    _status['admission'] = admission.stats()
+    _status['jobs'] = job_worker.stats()
+    try:
+        _status['jobs']['queue'] = await run_in_threadpool(job_store.queue_length)
+    except Exception as e:
+        logger.warning(f"Failed to get job queue length: {e}")
+        _status['jobs']['queue'] = None  # job store not available
     return _status
 
 
+class JobRequest(BaseModel):
+    input: str
+    format: str = 'markdown'  # markdown | json
+    use_cache: bool = True
+
+
+async def _get_job(job_id: str) -> dict:
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+async def stream_job(job_id: str, request: Request):
+    """
+    Stream events of a job from the store as workers add them, then the final report or the error.
+    Events are cleared when a job is requeued, the offset is kept so stages repeated by the new worker are not streamed twice.
+    """
+    _poll_interval = settings.JOB_POLL_INTERVAL / 1000
+    _heartbeat_interval = 30
+    loop = asyncio.get_running_loop()
+    heartbeat = loop.time() + _heartbeat_interval
+    start = 0
+    while True:
+        job = await run_in_threadpool(job_store.get, job_id)
+        if job is None:  # expired
+            return
+        events = await run_in_threadpool(job_store.get_events, job_id, start)
+        start += len(events)
+        for event in events:
+            yield utils.get_stream(stage=event['stage'], content=event['content'])
+        if events:
+            heartbeat = loop.time() + _heartbeat_interval
+        if job['status'] == 'done':
+            yield utils.get_stream(stage='final', content=job['result'])
+            return
+        if job['status'] == 'failed':
+            yield utils.get_stream(stage='error', content=job['error'])
+            return
+        if await request.is_disconnected():
+            return
+        if loop.time() >= heartbeat:
+            yield utils.get_stream(stage='processing', content='processing ...')
+            heartbeat = loop.time() + _heartbeat_interval
+        await asyncio.sleep(_poll_interval)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(body: JobRequest):
+    """
+    Queue a check, poll `GET /jobs/{id}` or stream `GET /jobs/{id}/stream` for the result.
+    Returns 503 with `Retry-After` if the job queue is full.
+    """
+    if not body.input or not utils.check_input(body.input):
+        raise HTTPException(status_code=400, detail="Invalid input")
+    if body.format not in ['markdown', 'json']:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    try:
+        if settings.JOB_QUEUE_SIZE and await run_in_threadpool(job_store.queue_length) >= settings.JOB_QUEUE_SIZE:
+            return PlainTextResponse(status_code=503, content="Job queue full, please retry later", headers={"Retry-After": str(admission.retry_after())})
+        job_id = await run_in_threadpool(job_store.create, body.model_dump())
+    except Exception as e:
+        logger.error(f"Failed to create job: {e}")
+        raise HTTPException(status_code=500, detail="Service not available")
+    return {"id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status, with the final report once done or the error once failed"""
+    job = await _get_job(job_id)
+    return {key: job[key] for key in ['id', 'status', 'result', 'error', 'created', 'updated']}
+
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, start: int = 0):
+    """Stage events of a job from offset `start`, poll again with `next` as the offset"""
+    job = await _get_job(job_id)
+    events = await run_in_threadpool(job_store.get_events, job_id, start)
+    return {"status": job['status'], "events": events, "next": start + len(events)}
+
+
+@app.get("/jobs/{job_id}/stream")
+async def get_job_stream(job_id: str, request: Request):
+    """Stream stage events of a job in the same format as the check stream, from any web instance"""
+    await _get_job(job_id)
+    return StreamingResponse(stream_job(job_id, request), media_type="text/event-stream")
+
+
 @app.get("/{input:path}", response_class=PlainTextResponse)
 async def catch_all(input: str, request: Request):
     """
     Headers:
       - Accept: text/event-stream (Without this header returns the basic HTML page)
       - X-Return-Format: markdown | json (Choose the return format, default markdown)
+      - Cache-Control: no-cache (Bypass cached verdicts, fresh verdicts still update the cache)
     """
     # Catch all exception to avoid inner error message expose to public
     try:
@@ -88,8 +276,23 @@ async def catch_all(input: str, request: Request):
         if return_format not in ['markdown', 'json']:
             return_format = 'markdown'
 
+        # Bypass verdict cache
+        use_cache = 'no-cache' not in (headers.get("Cache-Control") or '').lower()
+
+        # Admission control, joining an identical check in flight costs nothing
+        ticket = None
+        priority = 1 if settings.LONG_INPUT_MODE and len(input) > settings.LONG_INPUT_CHUNK_SIZE else 0  # long input checks cost more
+        if not checks.in_flight((checks.normalize(input), return_format, use_cache)):
+            try:
+                ticket = await admission.admit(priority=priority)
+            except Overloaded as e:
+                return PlainTextResponse(status_code=503, content="Service overloaded, please retry later", headers={"Retry-After": str(e.retry_after)})
+
         # Streaming content
-        return StreamingResponse(stream_response(input=input, format=return_format), media_type="text/event-stream")
+        stream = stream_response(input=input, format=return_format, use_cache=use_cache, request=request, ticket=ticket, priority=priority)
+        if ticket is not None:
+            weakref.finalize(stream, ticket.release)  # release if the stream never starts, no-op once attached to the check
+        return StreamingResponse(stream, media_type="text/event-stream")
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -1,8 +1,8 @@
-__all__ = ['Citation', 'ContextVerdict', 'LlamaIndexRM', 'Search', 'SearchQuery', 'Statements']
+__all__ = ['Citation', 'ContextVerdict', 'EvidenceRM', 'LlamaIndexRM', 'Search', 'SearchQuery', 'Statements']
 
 from .citation import Citation
 from .context_verdict import ContextVerdict
-from .retrieve import LlamaIndexRM
+from .retrieve import EvidenceRM, LlamaIndexRM
 from .search import Search
 from .search_query import SearchQuery
 from .statements import Statements
@@ -10,10 +10,11 @@ from .statements import Statements
 import dspy
 
 from settings import settings
+from .lm import OpenAI
 
 # set DSPy default language model
-llm = dspy.OpenAI(model=settings.LLM_MODEL_NAME, api_base=f"{settings.OPENAI_BASE_URL}/", max_tokens=200, stop='\n\n')
+llm = OpenAI(model=settings.LLM_MODEL_NAME, api_base=f"{settings.OPENAI_BASE_URL}/", max_tokens=200, stop='\n\n')
 dspy.settings.configure(lm=llm)
 
 # LM with higher token limits
-llm_long = dspy.OpenAI(model=settings.LLM_MODEL_NAME, api_base=f"{settings.OPENAI_BASE_URL}/", max_tokens=500, stop='\n\n')
+llm_long = OpenAI(model=settings.LLM_MODEL_NAME, api_base=f"{settings.OPENAI_BASE_URL}/", max_tokens=500, stop='\n\n')
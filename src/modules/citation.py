@@ -1,5 +1,7 @@
 import dspy
 
+from .lm import apredict
+
 class GenerateCitedParagraph(dspy.Signature):
     """Generate a paragraph with citations."""
     context = dspy.InputField(desc="May contain relevant facts.")
@@ -17,3 +19,8 @@ class Citation(dspy.Module):
         citation = self.generate_cited_paragraph(context=context, statement=statement, verdict=verdict)
         pred = dspy.Prediction(verdict=verdict, citation=citation.paragraph, context=context)
         return pred
+
+    async def aforward(self, statement, context, verdict, lm=None):
+        citation = await apredict(self.generate_cited_paragraph, lm=lm, context=context, statement=statement, verdict=verdict)
+        pred = dspy.Prediction(verdict=verdict, citation=citation.paragraph, context=context)
+        return pred
@@ -1,6 +1,9 @@
 import dspy
 import re
 from dsp.utils import deduplicate
+from fastapi.concurrency import run_in_threadpool
+
+from .lm import apredict
 
 class CheckStatement(dspy.Signature):
     """Verify the statement based on the provided context."""
@@ -58,4 +61,21 @@ class ContextVerdict(dspy.Module):
         _verdict_predict = self.generate_verdict(context=context, statement=statement)
         verdict = extract_verdict(_verdict_predict.verdict)
         pred = dspy.Prediction(answer=verdict, rationale=_verdict_predict.rationale, context=context)
+        return pred
+
+    def _retrieve(self, rm, query):
+        with dspy.context(rm=rm):
+            return self.retrieve(query).passages
+
+    async def aforward(self, statement, rm):
+        """Async version of `forward`, retrieval runs in threadpool with the given retriever"""
+        context = []
+        for hop in range(self.max_hops):
+            query = (await apredict(self.generate_query[hop], context=context, statement=statement)).query
+            passages = await run_in_threadpool(self._retrieve, rm, query)
+            context = deduplicate(context + passages)
+
+        _verdict_predict = await apredict(self.generate_verdict, context=context, statement=statement)
+        verdict = extract_verdict(_verdict_predict.verdict)
+        pred = dspy.Prediction(answer=verdict, rationale=_verdict_predict.rationale, context=context)
         return pred
\ No newline at end of file
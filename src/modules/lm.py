@@ -0,0 +1,217 @@
+import asyncio
+import dsp
+import dspy
+import json
+import openai
+from dspy.signatures.signature import signature_to_template
+
+from runtime import retries, scheduler, transport
+from settings import settings
+
+_aclient = None
+
+# retries of LLM requests go through the shared retry budget, not the OpenAI clients or DSPy backoff
+openai.max_retries = 0  # module client used by DSPy
+# sync DSPy requests use the pooled `llm` client, its request hook caps timeouts by the request deadline
+openai.http_client = transport.client('llm')
+
+def _retryable(e: BaseException) -> bool:
+    """Retry connection errors, timeouts, rate limits and server errors only"""
+    return isinstance(e, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+def get_aclient() -> openai.AsyncOpenAI:
+    """Get the shared async OpenAI compatible client, create at the first use"""
+    global _aclient
+    if _aclient is None:
+        _aclient = openai.AsyncOpenAI(
+            base_url=settings.OPENAI_BASE_URL,
+            api_key=settings.OPENAI_API_KEY or "EMPTY",
+            http_client=transport.aclient('llm'),
+            max_retries=0,
+        )
+    return _aclient
+
+class PromptBatcher():
+    """
+    Collect LLM prompts submitted within a short window and send them together.
+
+    Prompts are grouped by client and request parameters, each group is sent as one completions
+    request with a list of prompts. Text models only: chat models have no batch endpoint,
+    waiting for the window would only add latency, so their prompts are sent right away.
+
+    Sources of a statement run their hops at about the same pace, so per-hop query prompts
+    and the final verdict prompts of all sources mostly land in the same batches.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        """
+        Args:
+          - window: seconds to wait for more prompts after the first one of a batch
+          - max_size: max prompts per batch, a full batch is sent right away
+        """
+        self.window = window
+        self.max_size = max_size
+        self._pending = {}  # group key -> (lm, kwargs, list of (prompt, future), timer handle)
+        self._tasks = set()  # batches in flight, keep references until done
+
+        # stats
+        self.batches = 0
+        self.prompts = 0
+
+    async def submit(self, lm: "OpenAI", prompt: str, kwargs: dict) -> list:
+        """Add one prompt to a batch and wait for its choices"""
+        loop = asyncio.get_running_loop()
+        key = (id(lm), json.dumps(kwargs, sort_keys=True, default=str))
+        future = loop.create_future()
+
+        batch = self._pending.get(key)
+        if batch is None:
+            handle = loop.call_later(self.window, self._flush, key)
+            batch = self._pending[key] = (lm, kwargs, [], handle)
+        batch[2].append((prompt, future))
+        if len(batch[2]) >= self.max_size:
+            batch[3].cancel()
+            self._flush(key)
+        return await future
+
+    def _flush(self, key):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        lm, kwargs, items, _ = batch
+        self.batches += 1
+        self.prompts += len(items)
+        task = asyncio.create_task(self._send(lm, kwargs, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, lm: "OpenAI", kwargs: dict, items: list):
+        try:
+            try:
+                results = await lm.arequest_batch([prompt for prompt, _ in items], **kwargs)
+            except Exception as e:
+                results = [e] * len(items)
+
+            for (_, future), result in zip(items, results):
+                if future.done():  # submitter cancelled
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            # batch cancelled, e.g. at shutdown, submitters must not wait forever
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(RuntimeError("LLM batch request cancelled"))
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'prompts': self.prompts,
+            'pending': sum(len(batch[2]) for batch in self._pending.values()),
+        }
+
+prompt_batcher = PromptBatcher(window=settings.LLM_BATCH_WINDOW / 1000, max_size=settings.LLM_BATCH_MAX_SIZE)
+
+class OpenAI(dspy.OpenAI):
+    """
+    DSPy OpenAI client, requests run within the `llm` stage concurrency limit
+    and retry within the shared `llm` retry budget. Both sync and async requests go through
+    the pooled `llm` HTTP client, which caps their timeouts by the request deadline.
+
+    Adds `acall` for the async execution mode, which uses the shared async client
+    instead of holding a thread for each request. With `LLM_BATCH` enabled, prompts of text models go through `prompt_batcher`.
+    """
+
+    @retries.policy('llm', retry_on=_retryable)
+    def request(self, prompt: str, **kwargs):
+        """Same as DSPy `request` without its own backoff"""
+        kwargs.pop("model_type", None)
+        return self.basic_request(prompt, **kwargs)
+
+    def basic_request(self, prompt: str, **kwargs):
+        with scheduler.slot('llm'):
+            return super().basic_request(prompt, **kwargs)
+
+    @retries.policy('llm', retry_on=_retryable)
+    async def arequest(self, prompt: str, **kwargs) -> list:
+        """Send one prompt, returns list of choices"""
+        client = get_aclient()
+        async with scheduler.slot('llm'):
+            if self.model_type == "chat":
+                messages = [{"role": "user", "content": prompt}]
+                if self.system_prompt:
+                    messages.insert(0, {"role": "system", "content": self.system_prompt})
+                response = await client.chat.completions.create(messages=messages, **kwargs)
+            else:
+                response = await client.completions.create(prompt=prompt, **kwargs)
+        return response.choices
+
+    @retries.policy('llm', retry_on=_retryable)
+    async def arequest_batch(self, prompts: list[str], **kwargs) -> list[list]:
+        """Send multiple prompts in one completions request (text models only), returns list of choices per prompt"""
+        client = get_aclient()
+        async with scheduler.slot('llm'):
+            response = await client.completions.create(prompt=prompts, **kwargs)
+
+        # choices of prompt i have index from i * n to (i + 1) * n - 1
+        n = kwargs.get("n") or 1
+        results = [[] for _ in prompts]
+        for choice in sorted(response.choices, key=lambda c: c.index):
+            results[choice.index // n].append(choice)
+        return results
+
+    async def acall(self, prompt: str, **kwargs) -> list[str]:
+        """Async version of `__call__`, returns list of completion texts"""
+        kwargs = {**self.kwargs, **kwargs}
+        if settings.LLM_BATCH and self.model_type != "chat":
+            choices = await prompt_batcher.submit(self, prompt, kwargs)
+        else:
+            choices = await self.arequest(prompt, **kwargs)
+
+        # same as `__call__`: prefer choices not cut by length
+        choices = [c for c in choices if c.finish_reason != "length"] or choices
+        if self.model_type == "chat":
+            return [c.message.content for c in choices]
+        return [c.text for c in choices]
+
+async def agenerate(signature, demos, lm: OpenAI = None, max_depth: int = 2, **kwargs) -> dspy.Prediction:
+    """
+    Async version of `dsp.generate` for one completion.
+
+    Render the prompt with signature and demos, extract output fields from the completion.
+    If fields are missing, continue from the farthest field with a shorter length, up to `max_depth` times.
+    """
+    lm = lm or dspy.settings.lm
+    template = signature_to_template(signature)
+    example = dsp.Example(demos=demos, **kwargs)
+    field_names = [field.input_variable for field in template.fields]
+    lm_kwargs = {}
+
+    for _ in range(max_depth + 1):
+        completions = await lm.acall(template(example), **lm_kwargs)
+        completion = template.extract(example, completions[0])
+
+        # find the field after the farthest field generated
+        last_field_idx = 0
+        for field_idx, key in enumerate(field_names):
+            if completion.get(key) is not None:
+                last_field_idx = field_idx + 1
+        if last_field_idx == len(field_names):
+            return dspy.Prediction(**{k: completion[k] for k in signature.output_fields})
+
+        completion[field_names[last_field_idx]] = ""
+        example = completion
+        max_tokens = lm.kwargs["max_tokens"]
+        lm_kwargs = {"max_tokens": min(max(75, max_tokens // 2), max_tokens)}
+
+    raise ValueError(f"LM output missing fields: {field_names[last_field_idx:]}")
+
+async def apredict(predictor, lm: OpenAI = None, **kwargs) -> dspy.Prediction:
+    """Run a `dspy.Predict` or `dspy.ChainOfThought` predictor with the async LM client"""
+    if isinstance(predictor, dspy.ChainOfThought):
+        signature = predictor.extended_signature
+    else:
+        signature = predictor.signature
+    return await agenerate(signature, predictor.demos, lm=lm, **kwargs)
@@ -0,0 +1,156 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.utils import infer_torch_device
+from llama_index.postprocessor.jinaai_rerank import JinaRerank
+
+from runtime import scheduler
+from settings import settings
+
+class RerankService():
+    """
+    Process-wide rerank service shared by all retrievers.
+
+    Deploy modes:
+      - local: cross-encoder model loaded once, concurrent requests within a short window
+        are merged into a single forward pass by one worker thread
+      - api: one `JinaRerank` client per `top_n`, requests run within the `rerank` stage concurrency limit
+
+    Call `load` at app start to avoid loading the model at the first request.
+    """
+
+    def __init__(self, deploy: str, model: str, batch_window: float, batch_max_size: int):
+        """
+        Args:
+          - deploy: local | api
+          - model: rerank model name
+          - batch_window: seconds to wait for more requests after the first one of a batch, local mode only
+          - batch_max_size: max query-text pairs of one forward pass, local mode only
+        """
+        self.deploy = deploy
+        self.model = model
+        self.batch_window = batch_window
+        self.batch_max_size = batch_max_size
+
+        self._lock = threading.Lock()
+        self._model = None
+        self._clients = {}  # top_n -> JinaRerank
+        self._queue = queue.Queue()  # (pairs, future)
+
+        # stats
+        self.batches = 0
+        self.requests = 0
+
+    def load(self):
+        """Load model and start the batching worker, blocking"""
+        if self.deploy != "local":
+            return
+        with self._lock:
+            if self._model is not None:
+                return
+            from sentence_transformers import CrossEncoder  # TODO: add support `trust_remote_code=True`
+            self._model = CrossEncoder(self.model, max_length=512, device=infer_torch_device())
+            threading.Thread(target=self._worker, name="rerank", daemon=True).start()
+            logging.info(f"Rerank model loaded: {self.model}")
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.batch_window
+            while size < self.batch_max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            pairs = [pair for _pairs, _ in batch for pair in _pairs]
+            try:
+                scores = self._model.predict(pairs)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.requests += len(batch)
+            start = 0
+            for _pairs, future in batch:
+                future.set_result([float(s) for s in scores[start:start + len(_pairs)]])
+                start += len(_pairs)
+
+    def _get_client(self, top_n: int) -> JinaRerank:
+        with self._lock:
+            client = self._clients.get(top_n)
+            if client is None:
+                client = self._clients[top_n] = JinaRerank(
+                    base_url=settings.RERANK_BASE_URL,
+                    api_key=settings.RERANK_API_KEY,
+                    top_n=top_n,
+                    model=self.model,
+                )
+            return client
+
+    def score(self, query: str, texts: list[str]) -> list[float]:
+        """Get relevance scores of texts to the query with the local model, blocking"""
+        self.load()
+        future = Future()
+        self._queue.put(([(query, text) for text in texts], future))
+        return future.result()
+
+    def rerank(self, nodes: list[NodeWithScore], query: str, top_n: int) -> list[NodeWithScore]:
+        """Rerank nodes and return the top n, blocking"""
+        if not nodes:
+            return []
+        if self.deploy != "local":
+            with scheduler.slot('rerank'):
+                return self._get_client(top_n).postprocess_nodes(nodes, query_str=query)
+
+        scores = self.score(query, [node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes])
+        for node, score in zip(nodes, scores):
+            node.score = score
+        return sorted(nodes, key=lambda x: -x.score)[:top_n]
+
+    def stats(self) -> dict:
+        return {
+            'loaded': self._model is not None,
+            'batches': self.batches,
+            'requests': self.requests,
+            'queued': self._queue.qsize(),
+        }
+
+class SharedRerank(BaseNodePostprocessor):
+    """Rerank postprocessor backed by the shared rerank service"""
+
+    top_n: int
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SharedRerank"
+
+    def _postprocess_nodes(
+        self,
+        nodes: list[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> list[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        return rerank_service.rerank(nodes, query_bundle.query_str, self.top_n)
+
+rerank_service = RerankService(
+    deploy=settings.RERANK_MODEL_DEPLOY,
+    model=settings.RERANK_MODEL_NAME,
+    batch_window=settings.RERANK_BATCH_WINDOW / 1000,
+    batch_max_size=settings.RERANK_BATCH_MAX_SIZE,
+)
@@ -1,5 +1,6 @@
 import dspy
 import logging
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
 
 from llama_index.core import (
@@ -9,14 +10,15 @@ from llama_index.core import (
 )
 from llama_index.core.node_parser import HierarchicalNodeParser, get_leaf_nodes
 from llama_index.core.retrievers import AutoMergingRetriever
-from llama_index.core.indices.postprocessor import SentenceTransformerRerank
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.llms import MockLLM
-from llama_index.postprocessor.jinaai_rerank import JinaRerank
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
 
 import utils
-from integrations import InfinityEmbedding, OllamaEmbedding
+from cache import evidence_store
+from integrations import InfinityEmbedding, NumpyVectorStore, OllamaEmbedding
 from settings import settings
+from .rerank import SharedRerank, rerank_service
 
 Settings.llm = MockLLM(max_tokens=256)  # retrieve only, do not use LLM for synthesize
 
@@ -49,6 +51,7 @@ class LlamaIndexCustomRetriever():
         similarity_top_k: Optional[int] = 6,
     ):
         self.similarity_top_k = similarity_top_k
+        self._query_engines = {}  # (similarity_top_k, rerank_top_n) -> query engine of the index
         if docs:
             self.build_index(docs)
         
@@ -61,15 +64,40 @@ class LlamaIndexCustomRetriever():
         self.nodes = node_parser.get_nodes_from_documents(documents)
         leaf_nodes = get_leaf_nodes(self.nodes)
 
-        storage_context = StorageContext.from_defaults()
+        storage_context = StorageContext.from_defaults(vector_store=NumpyVectorStore())
         storage_context.docstore.add_documents(self.nodes)
 
-        # TODO: enable async
+        # leaf nodes embedded already are not sent to the embedding model again
         automerging_index = VectorStoreIndex(
             leaf_nodes, storage_context=storage_context, use_async=False
         )
                 
         return automerging_index
+
+    async def abuild_automerging_index(
+        self,
+        documents,
+        chunk_sizes=[2048, 512, 128],
+    ):
+        """
+        Async version of `build_automerging_index`.
+        Leaf embeddings are fetched on the event loop in concurrent sub-batches before the index build.
+        """
+        node_parser = HierarchicalNodeParser.from_defaults(chunk_sizes=chunk_sizes)
+        nodes = await run_in_threadpool(node_parser.get_nodes_from_documents, documents)
+        leaf_nodes = get_leaf_nodes(nodes)
+
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in leaf_nodes]
+        embeddings = await Settings.embed_model.aget_text_embedding_batch(texts)
+        for node, embedding in zip(leaf_nodes, embeddings):
+            node.embedding = embedding
+
+        def _build():
+            self.nodes = nodes
+            storage_context = StorageContext.from_defaults(vector_store=NumpyVectorStore())
+            storage_context.docstore.add_documents(nodes)
+            return VectorStoreIndex(leaf_nodes, storage_context=storage_context, use_async=False)
+        return await run_in_threadpool(_build)
     
     def get_automerging_query_engine(
         self,
@@ -81,20 +109,8 @@ class LlamaIndexCustomRetriever():
         retriever = AutoMergingRetriever(
             base_retriever, automerging_index.storage_context, verbose=True
         )
+        rerank = SharedRerank(top_n=rerank_top_n)
 
-        # TODO: load model files at app start
-        if settings.RERANK_MODEL_DEPLOY == "local":
-            rerank = SentenceTransformerRerank(
-                top_n=rerank_top_n, model=settings.RERANK_MODEL_NAME,
-            )  # TODO: add support `trust_remote_code=True`
-        else:
-            rerank = JinaRerank(
-                base_url = settings.RERANK_BASE_URL,
-                api_key=settings.RERANK_API_KEY, 
-                top_n=rerank_top_n, 
-                model=settings.RERANK_MODEL_NAME,
-            )
-        
         auto_merging_engine = RetrieverQueryEngine.from_args(
             retriever, node_postprocessors=[rerank]
         )
@@ -109,16 +125,28 @@ class LlamaIndexCustomRetriever():
                 docs,
                 chunk_sizes=settings.INDEX_CHUNK_SIZES,
             )  # TODO: try to retrieve directly
-        
+            self._query_engines = {}
+
+    async def abuild_index(self, docs):
+        """Async version of `build_index`"""
+        if docs:
+            self.index = await self.abuild_automerging_index(
+                docs,
+                chunk_sizes=settings.INDEX_CHUNK_SIZES,
+            )
+            self._query_engines = {}
+
     def retrieve(self, query):
         # TODO: get query engine performance costs
         rerank_top_n=self.similarity_top_k
-        query_engine = self.get_automerging_query_engine(
-            automerging_index=self.index,
-            similarity_top_k=rerank_top_n * 3,
-            rerank_top_n=rerank_top_n
-        )
-        self.query_engine = query_engine
+        _key = (rerank_top_n * 3, rerank_top_n)
+        if _key not in self._query_engines:  # reuse across hops
+            self._query_engines[_key] = self.get_automerging_query_engine(
+                automerging_index=self.index,
+                similarity_top_k=rerank_top_n * 3,
+                rerank_top_n=rerank_top_n
+            )
+        self.query_engine = self._query_engines[_key]
         auto_merging_response = self.query_engine.query(query)
         contexts = utils.llama_index_nodes_to_list(auto_merging_response.source_nodes)
 
@@ -159,6 +187,16 @@ class LlamaIndexRM(dspy.Retrieve):
 
         self.retriever = LlamaIndexCustomRetriever(docs=self.docs)
 
+    @classmethod
+    async def acreate(cls, docs, k: Optional[int] = None):
+        """Create with the index built by the async embedding path"""
+        rm = cls(docs=None)
+        await rm.retriever.abuild_index(docs)
+        rm.docs = docs
+        if k:
+            rm.k = k
+        return rm
+
     @property
     def k(self) -> Optional[int]:
         """Get similarity top k of retriever."""
@@ -204,4 +242,50 @@ class LlamaIndexRM(dspy.Retrieve):
                 dspy.Example(**{'long_text': result.pop('text', None), **result})
                 for result in raw
             ]
-        return rep
\ No newline at end of file
+        return rep
+
+class EvidenceRM(dspy.Retrieve):
+    """Implements a retriever over the long-lived evidence store.
+
+    Candidates are selected by embedding similarity from the store, then reranked.
+
+    Args:
+        hosts (list): Optional; retrieve from chunks of these hosts only, None for all
+        k (int): Optional; the number of examples to retrieve
+    """
+
+    def __init__(
+        self,
+        hosts: Optional[list] = None,
+        k: Optional[int] = 6,
+    ):
+        self.hosts = hosts
+        self.k = k
+
+    def forward(self, query: str, k: Optional[int] = None, text_only = False) -> list[dspy.Example]:
+        """Get top k chunks of the query, same output as `LlamaIndexRM.forward`"""
+        if k:
+            self.k = k
+
+        query_embedding = Settings.embed_model.get_query_embedding(query)
+        candidates = evidence_store.search(query_embedding, k=self.k * 3, hosts=self.hosts)
+        nodes = [
+            NodeWithScore(node=TextNode(id_=c['id'], text=c['text'], metadata=c['metadata']), score=c['score'])
+            for c in candidates
+        ]
+        if nodes:
+            nodes = rerank_service.rerank(nodes, query, self.k)
+        raw = utils.llama_index_nodes_to_list(nodes)
+
+        # select top_n here because some rerank services does not support the feature
+        raw.sort(key=lambda x: x['score'], reverse=True)
+        raw = raw[:self.k]
+
+        if text_only:
+            rep = [result['text'] for result in raw]
+        else:
+            rep = [
+                dspy.Example(**{'long_text': result.pop('text', None), **result})
+                for result in raw
+            ]
+        return rep
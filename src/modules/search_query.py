@@ -1,6 +1,8 @@
 import dspy
 import logging
 
+from .lm import apredict
+
 """Notes: LLM will choose a direction based on known facts"""
 class GenerateSearchEngineQuery(dspy.Signature):
     """Write a search engine query that will help retrieve info related to the statement."""
@@ -15,4 +17,9 @@ class SearchQuery(dspy.Module):
     def forward(self, statement):
         query = self.generate_query(statement=statement)
         logging.info(f"DSPy CoT search query: {query}")
+        return query.query
+
+    async def aforward(self, statement):
+        query = await apredict(self.generate_query, statement=statement)
+        logging.info(f"DSPy CoT search query: {query}")
         return query.query
\ No newline at end of file
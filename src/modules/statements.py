@@ -1,8 +1,12 @@
 import dspy
 import logging
+import pydantic
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import List
 
+from .lm import agenerate
+
 # references: https://github.com/weaviate/recipes/blob/main/integrations/llm-frameworks/dspy/4.Structured-Outputs-with-DSPy.ipynb
 class Output(BaseModel):
     statements: List = Field(description="A list of key statements")
@@ -25,4 +29,20 @@ class Statements(dspy.Module):
     def forward(self, content):
         statements = self.generate_statements(content=content)
         logging.info(f"DSPy CoT statements: {statements}")
-        return statements.output.statements
\ No newline at end of file
+        return statements.output.statements
+
+    async def aforward(self, content):
+        """
+        Async version of `forward` with one try.
+        Fall back to `forward` in threadpool if the output failed to parse, which retries with error feedback.
+        """
+        predictor = self.generate_statements
+        signature = predictor._prepare_signature()
+        try:
+            statements = await agenerate(signature, predictor.predictor.demos, content=content)
+            output = signature.output_fields['output'].json_schema_extra['parser'](statements.output)
+        except (pydantic.ValidationError, ValueError) as e:
+            logging.warning(f"Async statements parse failed, retry in threadpool: {e}")
+            return await run_in_threadpool(self, content)
+        logging.info(f"DSPy CoT statements: {statements}")
+        return output.statements
\ No newline at end of file
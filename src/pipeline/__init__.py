@@ -1,23 +1,96 @@
 import asyncio
 import dspy
 import logging
+import math
 import os
+from typing import Callable
 from fastapi import HTTPException
 from fastapi.concurrency import run_in_threadpool
-from tenacity import retry, stop_after_attempt, wait_fixed
 from urllib.parse import urlparse
 
 import utils
 from api import ReadUrl, SearchWeb
+from cache import evidence_store, verdict_cache
 from modules import SearchQuery, Statements
-from modules import llm_long, Citation, LlamaIndexRM, ContextVerdict
+from modules import llm_long, Citation, EvidenceRM, LlamaIndexRM, ContextVerdict
+from runtime import cancel, deadline, read_governor, retries, scheduler
 from settings import settings
 
+# score of each verdict towards the statement summary
+VERDICT_SCORES = {'true': 1, 'false': -1}
+
 # loading compiled ContextVerdict
 optimizer_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"../optimizers/{settings.OPTIMIZER_FILE_NAME}")
 context_verdict = ContextVerdict()
 context_verdict.load(optimizer_path)
 
+class SourceDocs():
+    """
+    Reads of the docs of one source, lets the source pipeline start before all reads finish.
+    """
+
+    def __init__(self, read: Callable):
+        """
+        Args:
+          - read: coroutine function to read one data doc
+        """
+        self.read = read
+        self.data_docs = []
+        self.tasks = []
+        self._changed = asyncio.Event()
+        self._closed = False  # no more docs from search
+        self._sealed = False  # source pipeline started, no more reads
+
+    def add(self, data_doc):
+        """Add one doc and start reading it"""
+        if self._sealed:
+            data_doc['valid'] = False
+            data_doc['skipped'] = 'window'
+            return
+        self.data_docs.append(data_doc)
+        task = asyncio.create_task(self.read(data_doc))
+        task.add_done_callback(lambda _: self._changed.set())
+        self.tasks.append(task)
+
+    def close(self):
+        self._closed = True
+        self._changed.set()
+
+    def ready(self) -> list:
+        return [v for v in self.data_docs if v.get('doc')]
+
+    def _finished(self) -> bool:
+        return self._closed and all(task.done() for task in self.tasks)
+
+    async def wait(self, window: float):
+        """Wait for the first valid doc, then up to `window` seconds for the other docs, including ones found meanwhile"""
+        while not self.ready():
+            if self._finished():
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + window
+        while not self._finished():
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                return
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    def seal(self):
+        """Cancel unfinished reads and skip docs found later"""
+        self._sealed = True
+        for data_doc, task in zip(self.data_docs, self.tasks):
+            if not task.done():
+                task.cancel()
+                data_doc['valid'] = False
+                data_doc['skipped'] = 'window'
+
 class Check():
     """
     Run the full cycle from raw input to verdicts of multiple statements.
@@ -32,25 +105,82 @@ class Check():
       - Generate or draw class data structure.
     """
 
-    def __init__(self, input: str, format: str = 'markdown'):
+    def __init__(self, input: str, format: str = 'markdown', use_cache: bool = True, on_event: Callable = None, deadline: float = None):
         """
         Args:
           - input: raw input to check
           - format: markdown | json, format of the returning response
+          - use_cache: read statement verdicts from cache, fresh verdicts are written to cache either way
+          - on_event: function to receive stage events as they happen, takes dict with keys `stage`, `content`
+          - deadline: `time.monotonic()` based, propagated to all stages, statements not finished by then
+            get a partial summary of the sources finished in time
+
+        Stage events:
+          - statements: list of statements extracted
+          - query: search query of one statement
+          - verdict: verdict and citation of one source
+          - summary: summary of one statement
 
         Notes: avoid run I/O intense functions here to better support async
         """
         self.input = input
         self.format = format
+        self.use_cache = use_cache
+        self.on_event = on_event
+        self.deadline = deadline
         self.data = {}  # contains all intermediate and final data
+        self.llm_calls = 0  # LLM calls reserved, limited by `LLM_CALLS_BUDGET`
+
+    def publish(self, stage: str, content):
+        """Publish one stage event, failures do not affect the pipeline"""
+        if self.on_event is None:
+            return
+        try:
+            self.on_event({'stage': stage, 'content': content})
+        except Exception as e:
+            logging.warning(f"Failed to publish event {stage}: {e}")
+
+    def _reserve_llm(self, calls: int) -> bool:
+        """Reserve LLM calls from the per-request budget, return False if not enough left"""
+        budget = settings.LLM_CALLS_BUDGET
+        if budget and self.llm_calls + calls > budget:
+            return False
+        self.llm_calls += calls
+        return True
+
+    def progress(self) -> float:
+        """Share of statements summarized"""
+        if not self.data:
+            return 0
+        return sum(1 for v in self.data.values() if 'summary' in v) / len(self.data)
 
     async def final(self):
-        await self.get_statements()
-        _task = [asyncio.create_task(self._pipe_statement(data_statement)) for data_statement in self.data.values()]
-        await asyncio.gather(*_task)
+        """
+        Run the pipeline and return the reports.
 
-        # List of all summaries
-        summaries = [v['summary'] for v in self.data.values()]
+        Cancelling the task cancels all tasks of the check, and the cancel token stops its
+        threadpool jobs at their next stage slot.
+        """
+        if self.deadline is not None:
+            deadline.set_deadline(self.deadline)  # inherited by tasks created after
+        retries.start_request()  # retry budget of this check
+        token = cancel.CancelToken()
+        cancel.set_token(token)
+
+        try:
+            if settings.LONG_INPUT_MODE and len(self.input) > settings.LONG_INPUT_CHUNK_SIZE:
+                _task = await self._pipe_long_input()
+            else:
+                await self.get_statements()
+                _task = [asyncio.create_task(self._pipe_statement(data_statement)) for data_statement in self.data.values()]
+            await asyncio.gather(*_task)
+        except asyncio.CancelledError:
+            token.cancel()
+            logging.info(f"Check cancelled, progress: {self.progress():.0%}")
+            raise
+
+        # List of all summaries, in the order of the input
+        summaries = [v['summary'] for v in sorted(self.data.values(), key=lambda v: v['order'])]
 
         # Update reports
         if self.format == 'json':
@@ -66,81 +196,321 @@ class Check():
     async def _pipe_statement(self, data_statement):
         """
         Pipeline to process single statement.
-        Get all links to generate hostname mapping before fetch content and generate verdict citation for each hostname(source).
+        Search results are pipelined: each URL is read as soon as it arrives, each hostname(source) starts
+        its pipeline at the first URL and generates verdict citation once its docs are ready.
+
+        Return cached summary directly if the statement was checked recently.
 
         TODO:
           - Make unit works on URL instead of hostname level.
         """
-        await self.get_search_query(data_statement)
-        _updated_sources = await self.update_source_map(data_statement['sources'], data_statement['query'])
-        _task = [asyncio.create_task(self._pipe_source(data_statement['sources'][source], data_statement['statement'])) for source in _updated_sources]
-        await asyncio.gather(*_task)
+        if self.use_cache:
+            _summary = await run_in_threadpool(verdict_cache.get, data_statement['key'])
+            if _summary:
+                logging.info(f"Verdict cache hit: {data_statement['statement']}")
+                data_statement['summary'] = _summary
+                self.publish('summary', _summary)
+                return
+
+        if not self._reserve_llm(1):
+            logging.warning(f"LLM calls budget exhausted, skip statement: {data_statement['statement']}")
+            self.update_summary(data_statement)  # summary with verdict None
+            self.publish('summary', data_statement['summary'])
+            return
+
+        try:
+            await self.get_search_query(data_statement)
+            _task = await self.update_source_map(data_statement['sources'], data_statement['query'], data_statement['statement'])
+            await self._wait_sources(data_statement, _task)
+        except Exception as e:
+            if not deadline.expired():
+                raise
+            logging.warning(f"Deadline reached, summarize finished sources of statement: {data_statement['statement']}, {e!r}")
+            data_statement['partial'] = True
+            for data_source in data_statement['sources'].values():
+                if 'verdict' not in data_source:
+                    data_source['valid'] = False
+                    data_source.setdefault('skipped', 'deadline')
 
         # update summary
         self.update_summary(data_statement)
+        if data_statement.get('partial'):
+            data_statement['summary']['partial'] = True
+        self.publish('summary', data_statement['summary'])
 
-    async def _pipe_source(self, data_source, statement):
-        """Update docs and then update retriever, verdict, citation"""
-        
-        # update docs
-        _task_docs = []
-        for _, data_doc in data_source['docs'].items():
-            if not data_doc.get('doc') and data_doc.get('valid') is not False:  # TODO: better way to decide if update doc
-                _task_docs.append(asyncio.create_task(self.update_doc(data_doc)))
-        await asyncio.gather(*_task_docs)  # finish all docs processing
+        # cache complete valid verdicts only, let failed or partial ones retry on the next request
+        if data_statement['summary']['verdict'] and not data_statement.get('partial'):
+            await run_in_threadpool(verdict_cache.set, data_statement['key'], data_statement['summary'])
+
+    async def _wait_sources(self, data_statement, tasks: dict):
+        """
+        Wait for all source tasks, up to the request deadline.
+
+        With early stop enabled, keep a running score of finished verdicts and cancel the remaining tasks once:
+          - the winning verdict can no longer flip: score margin above the number of pending sources
+          - or the score margin reaches `VERDICT_QUORUM_MARGIN` if set
+        At the deadline the remaining tasks are cancelled and the statement is marked partial.
+        Cancelled sources are marked invalid and skipped in the summary.
+        """
+        sources = data_statement['sources']
+        pending = set(tasks)
+        score = 0
+        while pending:
+            try:
+                done, pending = await asyncio.wait(pending, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:  # `wait` leaves the tasks running
+                for task in pending:
+                    task.cancel()
+                raise
+            if not done:
+                logging.warning(f"Deadline reached, cancel {len(pending)} sources: {data_statement['statement']}")
+                data_statement['partial'] = True
+                await self._cancel_sources(sources, tasks, pending, 'deadline')
+                break
+
+            for task in done:
+                task.result()  # raise exceptions same as gather
+                data_source = sources[tasks[task]]
+                if data_source.get('valid') is not False:
+                    score += VERDICT_SCORES.get(data_source['verdict'].lower(), 0)
+
+            margin = settings.VERDICT_QUORUM_MARGIN
+            if settings.VERDICT_EARLY_STOP and pending and (abs(score) > len(pending) or (margin and abs(score) >= margin)):
+                logging.info(f"Verdict settled with score {score}, cancel {len(pending)} sources: {data_statement['statement']}")
+                await self._cancel_sources(sources, tasks, pending, 'quorum')
+                break
+
+    @staticmethod
+    async def _cancel_sources(sources: dict, tasks: dict, pending: set, reason: str):
+        """Cancel source tasks, mark the cancelled sources invalid with the reason"""
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in pending:
+            if task.cancelled():
+                sources[tasks[task]]['valid'] = False
+                sources[tasks[task]]['skipped'] = reason
+
+    async def _pipe_source(self, data_source, statement, hostname, source_docs: SourceDocs):
+        """
+        Wait for docs and then update retriever, verdict, citation.
+
+        Starts once the first valid doc of the source is read, docs read within `SOURCE_GATHER_WINDOW` seconds
+        after it are included, the unfinished reads are cancelled.
+
+        With the evidence store enabled, docs are added to the store and retrieved with a host filter
+        instead of building a per-request index.
+        """
+        try:
+            await source_docs.wait(settings.SOURCE_GATHER_WINDOW)
+        finally:
+            source_docs.seal()
 
         # update retriever
-        docs = [v['doc'] for v in data_source['docs'].values() if v.get('valid') is not False]
+        data_docs = source_docs.ready()
+        docs = [v['doc'] for v in data_docs]
         if docs:
-            data_source["retriever"] = await run_in_threadpool(LlamaIndexRM, docs=docs)
+            if settings.EVIDENCE_STORE:
+                _docs = [
+                    {'url': v['url'], 'host': hostname, 'text': v['doc'].text, 'fetched_at': (v.get('cache') or {}).get('fetched_at')}
+                    for v in data_docs
+                ]
+                async with scheduler.slot('index'):
+                    await run_in_threadpool(evidence_store.add_docs, _docs)
+                data_source["retriever"] = EvidenceRM(hosts=[hostname])
+            else:
+                async with scheduler.slot('index'):
+                    if settings.EMBEDDING_MODEL_DEPLOY == "local":
+                        data_source["retriever"] = await run_in_threadpool(LlamaIndexRM, docs=docs)
+                    else:  # embed leaf nodes concurrently on the event loop
+                        data_source["retriever"] = await LlamaIndexRM.acreate(docs=docs)
             
             # update verdict, citation
-            await run_in_threadpool(self.update_verdict_citation, data_source, statement)
+            async with scheduler.slot('verdict'):
+                if settings.LLM_ASYNC:
+                    await self.aupdate_verdict_citation(data_source, statement)
+                else:
+                    await run_in_threadpool(self.update_verdict_citation, data_source, statement)
+            self.publish('verdict', {
+                'statement': statement,
+                'source': f"http://{hostname}",
+                'verdict': data_source['verdict'],
+                'citation': data_source['citation'],
+            })
         else:
             data_source['valid'] = False  # TODO: update status after add valid doc
                 
+    async def _pipe_long_input(self) -> list:
+        """
+        Long input mode: split input into chunks and extract statements from all chunks concurrently.
+        Once a chunk finishes, its statements are deduped against the accepted ones, ranked by
+        check-worthiness and started in the per-statement pipeline right away.
+
+        Budgets:
+          - `LONG_INPUT_MAX_STATEMENTS`: statements in total, each chunk gets an even share
+          - `LLM_CALLS_BUDGET`: one call reserved for each chunk, chunks beyond the budget are skipped
+
+        Return tasks of the per-statement pipeline.
+        """
+        chunks = utils.split_text(self.input, settings.LONG_INPUT_CHUNK_SIZE)
+        max_statements = settings.LONG_INPUT_MAX_STATEMENTS
+        quota = math.ceil(max_statements / len(chunks))  # per chunk
+        logging.info(f"Long input mode, chunks: {len(chunks)}")
+
+        async def _extract(idx, chunk):
+            return idx, await self._extract_statements(chunk)
+
+        _task_chunks = []
+        for idx, chunk in enumerate(chunks):
+            if not self._reserve_llm(1):
+                logging.warning(f"LLM calls budget exhausted, skip {len(chunks) - idx} chunks")
+                break
+            _task_chunks.append(asyncio.create_task(_extract(idx, chunk)))
+
+        self.statements = []
+        _task = []
+        try:
+            for _next in asyncio.as_completed(_task_chunks):
+                idx, statements = await _next
+                _limit = min(quota, max_statements - len(self.statements))
+                for data_statement in self._add_statements(statements, idx, _limit):
+                    _task.append(asyncio.create_task(self._pipe_statement(data_statement)))
+                if len(self.statements) >= max_statements:
+                    break
+        except BaseException:
+            for task in _task:
+                task.cancel()
+            raise
+        finally:
+            for task in _task_chunks:  # statements budget reached
+                task.cancel()
+
+        if not self.statements:
+            raise HTTPException(status_code=500, detail="No statements found")
+        return _task
+
+    def _add_statements(self, statements: list, chunk_idx: int, limit: int) -> list:
+        """
+        Add statements extracted from one chunk to the data.
+        Skip duplicate and near duplicate ones, keep up to `limit` by check-worthiness.
+
+        Return the added data statements.
+        """
+        _candidates = []
+        for i, v in enumerate(statements):
+            v = str(v).strip()
+            if not v or utils.get_md5(v) in self.data:
+                continue
+            if any(utils.is_near_duplicate(v, _v) for _v in self.statements + [c for _, c in _candidates]):
+                continue
+            _candidates.append(((chunk_idx, i), v))
+        _candidates.sort(key=lambda c: utils.get_check_worthiness(c[1]), reverse=True)
+
+        _added = []
+        for order, v in _candidates[:max(limit, 0)]:
+            _key = utils.get_md5(v)
+            self.data[_key] = {'key': _key, 'order': order, 'statement': v, 'sources': {}}
+            self.statements.append(v)
+            _added.append(self.data[_key])
+
+        if _added:
+            logging.info(f"statements of chunk {chunk_idx}: {[v['statement'] for v in _added]}")
+            self.publish('statements', [v['statement'] for v in _added])
+        return _added
+
     # Statements has retry set already, do not retry here
-    async def get_statements(self):
-        """Get list of statements from a text string"""
+    async def _extract_statements(self, text: str) -> list:
+        """Get list of statements from text, empty list if failed"""
         try:
             _dspy = Statements()
-            self.statements = await run_in_threadpool(_dspy, self.input)
+            if settings.LLM_ASYNC:
+                return await _dspy.aforward(text) or []
+            return await run_in_threadpool(_dspy, text) or []
         except Exception as e:
             logging.error(f"Get statements failed: {e}")
-            self.statements = []
+            return []
+
+    async def get_statements(self):
+        """Get list of statements from a text string"""
+        self._reserve_llm(1)
+        self.statements = await self._extract_statements(self.input)
 
         if not self.statements:
             raise HTTPException(status_code=500, detail="No statements found")
-        self.statements = self.statements[:2]  # TODO: limiting max statements to 2 since haven't support long input yet.
+        self.statements = self.statements[:2]  # TODO: limiting max statements to 2, enable long input mode for more.
         logging.info(f"statements: {self.statements}")
         
         # add statements to data with order
         for i, v in enumerate(self.statements, start=1):
             _key = utils.get_md5(v)
-            self.data.setdefault(_key, {'order': i, 'statement': v, 'sources': {}})
+            self.data.setdefault(_key, {'key': _key, 'order': i, 'statement': v, 'sources': {}})
+        self.publish('statements', self.statements)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(0.1), before_sleep=utils.retry_log_warning, reraise=True)
+    # LLM requests have retry set already, do not retry here
     async def get_search_query(self, data_statement):
         """Get search query for one statement and add to the data"""
         _dspy = SearchQuery()
-        data_statement['query'] = await run_in_threadpool(_dspy, data_statement['statement'])
+        if settings.LLM_ASYNC:
+            data_statement['query'] = await _dspy.aforward(data_statement['statement'])
+        else:
+            data_statement['query'] = await run_in_threadpool(_dspy, data_statement['statement'])
+        self.publish('query', {'statement': data_statement['statement'], 'query': data_statement['query']})
 
-    async def update_source_map(self, data_sources, query):
+    async def update_source_map(self, data_sources, query, statement) -> dict:
         """
-        Update map of sources(web URLs for now),
-        add to the data and return list of updated sources.
+        Update map of sources(web URLs for now) from the search stream and add to the data.
+
+        Each URL starts reading as soon as it arrives, each new source starts its pipeline at its first URL.
+        Source is skipped if its host circuit breaker is open, or the LLM calls budget can not cover its verdict and citation.
+
+        Return dict of source pipeline task to hostname.
         """
-        _updated = []
-        _search_web = SearchWeb(query=query)
-        async for url_dict in _search_web.get():
-            url = url_dict.get('url')
-            if not url:  # TODO: necessary?
-                continue
-            url_hash = utils.get_md5(url)
-            hostname = urlparse(url).hostname
-            data_sources.setdefault(hostname, {}).setdefault('docs', {}).update({url_hash: {'url': url}})
-            _updated.append(hostname) if hostname not in _updated else None
-        return _updated
+        _tasks = {}
+        _source_docs = {}  # hostname -> SourceDocs, None if skipped
+        try:
+            _search_web = SearchWeb(query=query)
+            async for url_dict in _search_web.get():
+                url = url_dict.get('url')
+                if not url:  # TODO: necessary?
+                    continue
+                url_hash = utils.get_md5(url)
+                hostname = urlparse(url).hostname
+
+                if hostname not in _source_docs:
+                    data_source = data_sources.setdefault(hostname, {})
+                    data_source.setdefault('docs', {})
+                    if not read_governor.allow(hostname):  # host failing recently
+                        data_source['valid'] = False
+                        data_source['skipped'] = 'circuit'
+                        _source_docs[hostname] = None
+                        continue
+                    if not self._reserve_llm(context_verdict.max_hops + 2):  # query of each hop, verdict, citation
+                        data_source['valid'] = False
+                        data_source['skipped'] = 'budget'
+                        _source_docs[hostname] = None
+                        continue
+                    _source_docs[hostname] = SourceDocs(read=self.update_doc)
+                    _task = asyncio.create_task(self._pipe_source(data_source, statement, hostname, _source_docs[hostname]))
+                    _tasks[_task] = hostname
+
+                source_docs = _source_docs[hostname]
+                data_docs = data_sources[hostname]['docs']
+                if source_docs is None or url_hash in data_docs:
+                    continue
+                data_docs[url_hash] = {'url': url}
+                source_docs.add(data_docs[url_hash])
+        except BaseException:
+            for _task in _tasks:
+                _task.cancel()
+            for source_docs in _source_docs.values():
+                if source_docs:
+                    source_docs.seal()
+            raise
+
+        for source_docs in _source_docs.values():
+            if source_docs:
+                source_docs.close()
+        return _tasks
 
     async def update_doc(self, data_doc):
         """Update doc (URL content for now)"""
@@ -156,10 +526,12 @@ class Check():
             logging.warning(f"Failed to read URL, mark as invalid: {data_doc['url']}")
             return
         data_doc['raw'] = _rep  # dict including URL content and metadata, etc.
+        data_doc['cache'] = _rep.get('cache')  # read cache hit or miss
         data_doc['title'] = _rep['title']
         data_doc['doc'] = utils.search_result_to_doc(_rep)  # TODO: better process
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(0.5), before_sleep=utils.retry_log_warning, reraise=True)
+    # LLM requests have retry set already, retry the whole verdict once for the other errors
+    @retries.policy('llm', attempts=2)
     def update_verdict_citation(self, data_source, statement):
         """Update a single source"""
 
@@ -178,6 +550,21 @@ class Check():
         data_source['verdict'] = verdict
         data_source['citation'] = citation
 
+    @retries.policy('llm', attempts=2)
+    async def aupdate_verdict_citation(self, data_source, statement):
+        """Async version of `update_verdict_citation`, LLM calls run on the event loop"""
+        rep = await context_verdict.aforward(statement, rm=data_source['retriever'])
+        context = rep.context
+        verdict = rep.answer
+
+        # Use the LLM with higher token limit for citation generation call
+        rep = await Citation().aforward(statement=statement, context=context, verdict=verdict, lm=llm_long)
+        citation = rep.citation
+
+        data_source['context'] = context
+        data_source['verdict'] = verdict
+        data_source['citation'] = citation
+
     def update_summary(self, data_statement):
         """
         Calculate and summarize the verdicts of multiple sources.
@@ -238,10 +625,7 @@ class Check():
                   }
                 sum_citation[v]['citations'].append(citation)
                 sum_citation[v]['weight'] += 1
-                if v == 'true':
-                    sum_score += 1
-                elif v == 'false':
-                    sum_score -= 1
+                sum_score += VERDICT_SCORES.get(v, 0)
 
         # Return None if no valid verdict found
         if weight_valid == 0:
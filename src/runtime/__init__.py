@@ -0,0 +1,11 @@
+__all__ = ['AdmissionController', 'DeadlineExceeded', 'Flight', 'Hedger', 'HostGovernor', 'HostUnavailable', 'Overloaded', 'Retries', 'Scheduler', 'SingleFlight', 'TransportManager', 'admission', 'cancel', 'deadline', 'hedger', 'read_governor', 'retries', 'scheduler', 'transport']
+
+from . import cancel, deadline
+from .admission import AdmissionController, Overloaded, admission
+from .deadline import DeadlineExceeded
+from .governor import HostGovernor, HostUnavailable, read_governor
+from .hedge import Hedger, hedger
+from .retry import Retries, retries
+from .scheduler import Scheduler, scheduler
+from .singleflight import Flight, SingleFlight
+from .transport import TransportManager, transport
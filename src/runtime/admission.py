@@ -0,0 +1,202 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Optional
+
+from settings import settings
+from .scheduler import Scheduler, scheduler
+
+class Overloaded(Exception):
+    """Check request rejected by admission control"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after  # seconds
+
+class Ticket():
+    """One admitted check, release once when done, or attach to the task of the check"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.start = time.monotonic()
+        self.released = False
+        self.task = None
+
+    def attach(self, task: asyncio.Future):
+        """Hold the ticket until `task` is done, `release` calls before are ignored"""
+        self.task = task
+        task.add_done_callback(lambda _: self._release())
+
+    def release(self):
+        if self.task is None:
+            self._release()
+
+    def _release(self):
+        if self.released:
+            return
+        self.released = True
+        self.controller._release(self)
+
+class AdmissionController():
+    """
+    Admission control of check requests.
+
+    A check runs right away if below `max_checks` and the pipeline stages are not overloaded,
+    otherwise it waits in a bounded priority queue (lower priority value first) up to `queue_timeout` seconds.
+    Requests beyond the queue size or timed out in the queue are rejected with `Overloaded`, to return 503 fast.
+
+    Stages are overloaded when:
+      - waiters of a stage exceed its limit in `stage_queue_limits`
+      - or the recent wait of a busy stage exceeds `max_stage_wait` seconds
+
+    The same signals decide the readiness reported by `/health`.
+    """
+
+    def __init__(self, max_checks: int, queue_size: int, queue_timeout: float, stage_queue_limits: dict, max_stage_wait: float, scheduler: Scheduler = scheduler):
+        """
+        Args:
+          - max_checks: max checks running at once, 0 for no limit
+          - queue_size: max checks waiting for admission
+          - queue_timeout: seconds a check waits for admission before rejected
+          - stage_queue_limits: stage name -> max waiters of the stage
+          - max_stage_wait: seconds, max recent wait of the stages in `stage_queue_limits`
+          - scheduler: stages to watch
+        """
+        self.max_checks = max_checks
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.stage_queue_limits = stage_queue_limits
+        self.max_stage_wait = max_stage_wait
+        self.scheduler = scheduler
+
+        self.running = 0
+        self._queue = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._poll = None  # timer to recheck stages while checks are queued
+        self._duration = 30.0  # seconds, moving average of check duration
+
+        # stats
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def overloaded(self) -> Optional[str]:
+        """Reason if the pipeline stages are overloaded, None if not"""
+        for name, limit in self.stage_queue_limits.items():
+            stage = self.scheduler.stages.get(name)
+            if stage is None:
+                continue
+            stats = stage.stats()
+            if stats['waiting'] > limit:
+                return f"{name} queue {stats['waiting']} above {limit}"
+            if self.max_stage_wait and (stats['waiting'] or stats['in_use']) and stats['wait_recent'] > self.max_stage_wait:
+                return f"{name} wait {stats['wait_recent']:.1f}s above {self.max_stage_wait}s"
+        return None
+
+    def _can_run(self) -> bool:
+        if not self.running:  # always keep one check going
+            return True
+        if self.max_checks and self.running >= self.max_checks:
+            return False
+        return self.overloaded() is None
+
+    def retry_after(self) -> int:
+        """Seconds for a rejected client to wait, estimated from the queue and recent check duration"""
+        slots = self.max_checks or max(self.running, 1)
+        return max(1, round(self._duration * (len(self._queue) + 1) / slots))
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        logging.warning(f"Check rejected by admission control: {reason}")
+        raise Overloaded(reason, self.retry_after())
+
+    async def admit(self, priority: float = 0) -> Ticket:
+        """Wait for admission, raise Overloaded if rejected"""
+        if not self._queue and self._can_run():
+            return self._grant()
+
+        if len(self._queue) >= self.queue_size:
+            self._reject(self.overloaded() or f"queue full: {len(self._queue)}")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._queue, entry)
+        self.queued += 1
+        self._schedule_poll()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                future.result().release()  # admitted meanwhile, give it back
+            elif entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(f"queued over {self.queue_timeout}s")
+
+    def _grant(self) -> Ticket:
+        self.running += 1
+        self.admitted += 1
+        return Ticket(self)
+
+    def _release(self, ticket: Ticket):
+        self.running -= 1
+        self._duration += 0.1 * (time.monotonic() - ticket.start - self._duration)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit queued checks while there is capacity"""
+        while self._queue and self._can_run():
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(self._grant())
+        self._schedule_poll()
+
+    def _schedule_poll(self):
+        """Stage load changes without releases, recheck while checks are queued"""
+        if not self._queue or self._poll is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # released outside the event loop
+            return
+
+        def poll():
+            self._poll = None
+            self._dispatch()
+        self._poll = loop.call_later(0.5, poll)
+
+    def ready(self) -> dict:
+        """Readiness to take more checks, with reasons if not"""
+        reasons = []
+        overloaded = self.overloaded()
+        if overloaded:
+            reasons.append(overloaded)
+        if self.max_checks and self.running >= self.max_checks and len(self._queue) >= self.queue_size:
+            reasons.append(f"checks {self.running} running and queue full")
+        return {'ready': not reasons, 'reasons': reasons}
+
+    def stats(self) -> dict:
+        return {
+            'running': self.running,
+            'queue': len(self._queue),
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'duration_recent': round(self._duration, 2),
+        }
+
+admission = AdmissionController(
+    max_checks=settings.ADMISSION_MAX_CHECKS,
+    queue_size=settings.ADMISSION_QUEUE_SIZE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    stage_queue_limits=settings.ADMISSION_STAGE_QUEUE or {
+        'llm': settings.CONCURRENCY_LLM * 4,
+        'embedding': settings.CONCURRENCY_EMBEDDING * 4,
+    },
+    max_stage_wait=settings.ADMISSION_MAX_STAGE_WAIT,
+)
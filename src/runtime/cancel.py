@@ -0,0 +1,54 @@
+"""
+Cancellation of a check request across the event loop and threadpool.
+
+Tasks are cancelled by asyncio, but jobs in the threadpool can not be interrupted.
+The token of the request is set in a context variable, inherited by tasks and `run_in_threadpool` jobs,
+so thread jobs stop at their next stage slot instead of queueing more work.
+"""
+
+import contextvars
+import threading
+from typing import Callable, Optional
+
+class Cancelled(Exception):
+    """Work of a cancelled check request"""
+
+class CancelToken():
+    def __init__(self):
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable):
+        """Call `callback` on cancel, right away if cancelled already"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        """Raise Cancelled if cancelled"""
+        if self.cancelled:
+            raise Cancelled("Check request cancelled")
+
+_token = contextvars.ContextVar('cancel_token', default=None)
+
+def set_token(token: Optional[CancelToken]):
+    """Set cancel token of the current context, tasks and thread jobs started after inherit it"""
+    return _token.set(token)
+
+def get_token() -> Optional[CancelToken]:
+    return _token.get()
@@ -0,0 +1,45 @@
+"""
+Deadline of the current request, propagated to every stage with context variables.
+
+Set once at the start of a pipeline with `set_deadline`, tasks created after inherit it.
+Calls take the remaining budget as their timeout with `timeout(default)`.
+"""
+
+import contextvars
+import time
+from typing import Optional
+
+_deadline = contextvars.ContextVar('deadline', default=None)  # time.monotonic() based
+
+class DeadlineExceeded(TimeoutError):
+    """Deadline of the current request passed"""
+
+def set_deadline(at: Optional[float]):
+    """Set deadline of the current context, `time.monotonic()` based, None for no deadline"""
+    return _deadline.set(at)
+
+def get_deadline() -> Optional[float]:
+    return _deadline.get()
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the deadline capped by `default`, None if no deadline and no default"""
+    at = _deadline.get()
+    if at is None:
+        return default
+    left = max(0, at - time.monotonic())
+    return left if default is None else min(default, left)
+
+def expired() -> bool:
+    at = _deadline.get()
+    return at is not None and time.monotonic() >= at
+
+def timeout(default: float) -> float:
+    """Timeout of one call: `default` capped by the remaining budget, raise DeadlineExceeded if none left"""
+    left = remaining(default)
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left
+
+def stop_at_deadline(retry_state) -> bool:
+    """Tenacity stop condition, no more retries after the deadline"""
+    return expired()
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from settings import settings
+
+class HostUnavailable(Exception):
+    """Host skipped by an open circuit breaker"""
+
+class _Host():
+    def __init__(self, burst: int, success: float):
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+        # circuit breaker
+        self.failures = 0  # consecutive
+        self.open_until = 0  # breaker open before this time
+        self.trial_at = 0  # start of the half-open trial request, 0 if none
+
+        # rolling scores
+        self.success = success
+        self.latency = None  # seconds, successful reads only
+
+        # stats
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+
+class HostGovernor():
+    """
+    Per-host governor of outbound reads.
+
+    For each hostname:
+      - token bucket rate limit: `rate` requests per second with bursts up to `burst`
+      - circuit breaker: opens after `max_failures` consecutive failures and rejects requests for `cooldown` seconds,
+        then half-open: one trial request decides to close it or open it again
+      - health score: moving averages of success rate and latency, higher is better,
+        unknown hosts get a neutral prior
+
+    State of the `max_hosts` most recently used hosts is kept, others start over from the prior.
+
+    Usage:
+        trial = await read_governor.acquire(host)  # raise HostUnavailable if the breaker is open
+        try:
+            ...
+            read_governor.record(host, ok, seconds)
+        finally:
+            read_governor.release(host, trial)  # end the trial if no result was recorded, e.g. cancelled
+    """
+
+    def __init__(self, rate: float, burst: int, max_failures: int, cooldown: float, max_hosts: int, alpha: float = 0.2):
+        """
+        Args:
+          - rate: requests per second per host, 0 for no limit
+          - burst: max requests per host at once before the rate limit applies
+          - max_failures: consecutive failures to open the breaker
+          - cooldown: seconds the breaker stays open
+          - max_hosts: max number of hosts to keep state of, least recently used are dropped
+          - alpha: weight of the latest request in the moving averages
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_hosts = max_hosts
+        self.alpha = alpha
+
+        self.prior_success = 0.8
+        self.prior_latency = 5  # seconds
+
+        self._lock = threading.Lock()
+        self.hosts = OrderedDict()  # least recently used first
+
+    def _get(self, host: str) -> _Host:
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = _Host(self.burst, self.prior_success)
+            while len(self.hosts) > self.max_hosts:
+                self.hosts.popitem(last=False)
+        else:
+            self.hosts.move_to_end(host)
+        return state
+
+    def allow(self, host: str) -> bool:
+        """Whether the breaker of the host lets requests through, without taking a trial"""
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is None or not state.open_until:
+                return True
+            now = time.monotonic()
+            return now >= state.open_until and (not state.trial_at or now - state.trial_at >= self.cooldown)
+
+    async def acquire(self, host: str) -> float:
+        """
+        Wait for the rate limit of the host, raise HostUnavailable if the breaker is open.
+        Return the start time of the half-open trial if this request is the trial, otherwise 0.
+        """
+        trial = 0
+        with self._lock:
+            state = self._get(host)
+            now = time.monotonic()
+            if state.open_until:
+                if now < state.open_until or (state.trial_at and now - state.trial_at < self.cooldown):
+                    state.rejected += 1
+                    raise HostUnavailable(f"Circuit open for host {host}")
+                state.trial_at = trial = now  # half-open, this request is the trial
+
+            # reserve a token, wait if taken in advance
+            wait = 0
+            if self.rate > 0:
+                state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+                state.updated = now
+                state.tokens -= 1
+                if state.tokens < 0:
+                    wait = -state.tokens / self.rate
+            state.requests += 1
+
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self.release(host, trial)
+                raise
+        return trial
+
+    def release(self, host: str, trial: float):
+        """End the half-open trial started at `trial` without a result, so the next request can take one"""
+        if not trial:
+            return
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is not None and state.trial_at == trial:
+                state.trial_at = 0
+
+    def record(self, host: str, ok: bool, seconds: float):
+        """Record the result of one request"""
+        with self._lock:
+            state = self._get(host)
+            state.success += self.alpha * ((1 if ok else 0) - state.success)
+            if ok:
+                state.latency = seconds if state.latency is None else state.latency + self.alpha * (seconds - state.latency)
+                state.failures = 0
+                state.open_until = 0
+                state.trial_at = 0
+                return
+
+            state.errors += 1
+            state.failures += 1
+            if state.trial_at or state.failures >= self.max_failures:
+                state.open_until = time.monotonic() + self.cooldown
+                state.trial_at = 0
+
+    def score(self, host: str) -> float:
+        """Health score between 0 and 1, success rate discounted by latency"""
+        with self._lock:
+            state = self.hosts.get(host)
+            success = state.success if state else self.prior_success
+            latency = state.latency if state and state.latency is not None else self.prior_latency
+        return success / (1 + latency / self.prior_latency)
+
+    def priority(self, host: str) -> float:
+        """Scheduling priority, lower first, so healthy hosts are read first"""
+        return -self.score(host)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            hosts = list(self.hosts.items())
+            return {
+                'hosts': len(hosts),
+                'open': [host for host, state in hosts if state.open_until and now < state.open_until],
+                'requests': sum(state.requests for _, state in hosts),
+                'errors': sum(state.errors for _, state in hosts),
+                'rejected': sum(state.rejected for _, state in hosts),
+            }
+
+read_governor = HostGovernor(
+    rate=settings.READ_HOST_RATE,
+    burst=settings.READ_HOST_BURST,
+    max_failures=settings.READ_BREAKER_FAILURES,
+    cooldown=settings.READ_BREAKER_COOLDOWN,
+    max_hosts=settings.READ_MAX_HOSTS,
+)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Optional
+
+from settings import settings
+
+class Hedger():
+    """
+    Hedged requests: once a call takes longer than the observed latency quantile of its kind,
+    send one duplicate and take the first success, the other one is cancelled.
+
+    Latency is kept in a rolling window per name, no hedging before `min_samples` successes.
+    Use for idempotent requests only.
+    """
+
+    def __init__(self, enabled: bool, quantile: float, min_samples: int, window: int = 200):
+        """
+        Args:
+          - enabled: hedge or only record latency
+          - quantile: hedge after this latency quantile, e.g. 0.95
+          - min_samples: successes to record before hedging
+          - window: latest successes kept per name
+        """
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: deque(maxlen=self.window))
+
+        # stats
+        self.calls = defaultdict(int)
+        self.hedges = defaultdict(int)
+        self.wins = defaultdict(int)  # hedged duplicate finished first
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._latency[name].append(seconds)
+
+    def delay(self, name: str) -> Optional[float]:
+        """Seconds to wait before hedging, None if not enough samples"""
+        with self._lock:
+            samples = sorted(self._latency[name])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.quantile))]
+
+    async def run(self, name: str, factory: Callable[[], Awaitable], discard: Callable[..., Awaitable] = None):
+        """
+        Run the coroutine from `factory`, hedged with a second one if slow.
+
+        Args:
+          - name: kind of the call, latency is tracked per name
+          - factory: function returns a new coroutine of the call
+          - discard: coroutine function to release the result of the slower call if both succeed
+        """
+        self.calls[name] += 1
+        start = time.monotonic()
+        delay = self.delay(name) if self.enabled else None
+        if delay is None:
+            result = await factory()
+            self.record(name, time.monotonic() - start)
+            return result
+
+        first = asyncio.ensure_future(factory())
+        tasks = [first]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges[name] += 1
+                tasks.append(asyncio.ensure_future(factory()))
+
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if winner is None and task.exception() is None:
+                        winner = task
+            if winner is None:
+                return first.result()  # raise the error of the first call
+
+            self.record(name, time.monotonic() - start)
+            if winner is not first:
+                self.wins[name] += 1
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif discard and not task.cancelled() and task.exception() is None:
+                    try:
+                        await discard(task.result())
+                    except Exception as e:
+                        logging.warning(f"Failed to discard hedged result of {name}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                'calls': self.calls[name],
+                'hedges': self.hedges[name],
+                'wins': self.wins[name],
+                'delay': self.delay(name),
+            }
+            for name in list(self.calls)
+        }
+
+hedger = Hedger(
+    enabled=settings.HEDGE,
+    quantile=settings.HEDGE_QUANTILE,
+    min_samples=settings.HEDGE_MIN_SAMPLES,
+)
@@ -0,0 +1,197 @@
+"""
+Retry budgets shared by all layers, so retries do not multiply load on a struggling upstream.
+
+A retry needs a token from both:
+  - the upstream budget: each call earns `ratio` tokens up to `max_tokens`, each retry spends one,
+    so in an outage retries add at most `ratio` of the normal load
+  - the request budget: max retries of one check request, started with `start_request`
+
+Backoff is exponential with full jitter, capped by the request deadline.
+
+Usage:
+    @retries.policy('search')
+    async def fetch(): ...
+"""
+
+import contextvars
+import threading
+
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+import utils
+from settings import settings
+from .cancel import Cancelled
+from .deadline import DeadlineExceeded, remaining, stop_at_deadline
+from .governor import HostUnavailable
+
+class RetryBudget():
+    """Token bucket of retries of one upstream"""
+
+    def __init__(self, ratio: float, max_tokens: float):
+        """
+        Args:
+          - ratio: tokens earned by each call
+          - max_tokens: max and initial tokens, allows bursts of retries after idle time
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+        self._lock = threading.Lock()
+
+        # stats
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0  # retries denied by this budget
+
+    def deposit(self):
+        with self._lock:
+            self.calls += 1
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                self.rejected += 1
+                return False
+            self.tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'tokens': round(self.tokens, 2),
+        }
+
+class RequestRetries():
+    """Retries left of one check request, shared by all its tasks and threads"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.used >= self.limit:
+                self.exhausted = True
+                return False
+            self.used += 1
+            return True
+
+    def refund(self):
+        with self._lock:
+            self.used -= 1
+
+_request = contextvars.ContextVar('request_retries', default=None)
+
+def _retryable(e: BaseException) -> bool:
+    """Default retry condition: any error except the ones retry can not help"""
+    return isinstance(e, Exception) and not isinstance(e, (Cancelled, DeadlineExceeded, HostUnavailable))
+
+class Retries():
+    """Retry policies of all upstreams, see the module docstring"""
+
+    def __init__(self, ratio: float, max_tokens: float, request_limit: int, backoff_base: float, backoff_max: float):
+        """
+        Args:
+          - ratio: upstream budget tokens earned by each call
+          - max_tokens: upstream budget max tokens
+          - request_limit: max retries of one check request, 0 for no limit
+          - backoff_base: seconds, backoff of the first retry before jitter, doubled for each retry after
+          - backoff_max: seconds, max backoff
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.request_limit = request_limit
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self.budgets = {}
+
+        # stats
+        self.requests = 0
+        self.requests_exhausted = 0
+
+    def budget(self, upstream: str) -> RetryBudget:
+        with self._lock:
+            budget = self.budgets.get(upstream)
+            if budget is None:
+                budget = self.budgets[upstream] = RetryBudget(self.ratio, self.max_tokens)
+            return budget
+
+    def start_request(self):
+        """Start the retry budget of one check request in the current context, inherited by tasks created after"""
+        self.requests += 1
+        if self.request_limit:
+            _request.set(RequestRetries(self.request_limit))
+
+    def _stop(self, upstream: str):
+        """Tenacity stop condition, spends the retry tokens if not stopping"""
+        def stop(retry_state) -> bool:
+            request = _request.get()
+            if request is not None:
+                exhausted = request.exhausted
+                if not request.withdraw():
+                    if not exhausted:  # count each request once
+                        self.requests_exhausted += 1
+                    return True
+            if not self.budget(upstream).withdraw():
+                if request is not None:
+                    request.refund()
+                return True
+            return False
+        return stop
+
+    def _wait(self, backoff_base: float):
+        """Exponential backoff with full jitter, capped by the remaining time of the request deadline"""
+        jitter = wait_random_exponential(multiplier=backoff_base, max=self.backoff_max)
+        def wait(retry_state) -> float:
+            return remaining(jitter(retry_state))
+        return wait
+
+    def _before(self, upstream: str):
+        def before(retry_state):
+            if retry_state.attempt_number == 1:
+                self.budget(upstream).deposit()
+        return before
+
+    def policy(self, upstream: str, attempts: int = 3, backoff_base: float = None, retry_on=None):
+        """
+        Tenacity retry decorator drawing from the retry budgets.
+
+        Args:
+          - upstream: name of the budget, same names as the HTTP pools: search, embedding, llm
+          - attempts: max attempts including the first one
+          - backoff_base: seconds, overrides the default
+          - retry_on: function takes the exception and returns whether to retry, defaults to any error
+            except `Cancelled`, `DeadlineExceeded` and `HostUnavailable`
+        """
+        return retry(
+            stop=stop_after_attempt(attempts) | stop_at_deadline | self._stop(upstream),
+            wait=self._wait(backoff_base or self.backoff_base),
+            retry=retry_if_exception(retry_on or _retryable),
+            before=self._before(upstream),
+            before_sleep=utils.retry_log_warning,
+            reraise=True,
+        )
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'requests_exhausted': self.requests_exhausted,
+            'upstreams': {name: budget.stats() for name, budget in list(self.budgets.items())},
+        }
+
+retries = Retries(
+    ratio=settings.RETRY_BUDGET_RATIO,
+    max_tokens=settings.RETRY_BUDGET_MAX_TOKENS,
+    request_limit=settings.RETRY_REQUEST_BUDGET,
+    backoff_base=settings.RETRY_BACKOFF_BASE / 1000,
+    backoff_max=settings.RETRY_BACKOFF_MAX / 1000,
+)
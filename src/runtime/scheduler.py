@@ -0,0 +1,200 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+from settings import settings
+from .cancel import Cancelled, get_token
+
+class Stage():
+    """
+    Concurrency limit of one pipeline stage.
+
+    Slots are shared by the event loop (`await acquire()`) and threadpool (`acquire_sync()`),
+    waiters are served by priority (lower first) then in FIFO order,
+    and a released slot is handed over to the next waiter directly.
+
+    Waiters of a cancelled check request leave the queue: tasks by asyncio cancellation,
+    threads by the cancel token of the request, see `runtime.cancel`.
+    """
+
+    def __init__(self, name: str, limit: int, ewma_alpha: float = 0.1):
+        self.name = name
+        self.limit = limit
+
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters = []  # heap of (priority, seq, waiter), waiter is (loop, future) from the event loop or threading.Event from threads
+        self._seq = itertools.count()
+
+        # stats
+        self._alpha = ewma_alpha
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_recent = 0.0  # exponentially weighted moving average
+        self.hold_recent = 0.0
+        self.cancelled = 0  # waiters left the queue by cancellation
+
+    def _record_wait(self, seconds: float):
+        with self._lock:
+            self.acquired += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.wait_recent += self._alpha * (seconds - self.wait_recent)
+
+    def _record_hold(self, seconds: float):
+        with self._lock:
+            self.hold_recent += self._alpha * (seconds - self.hold_recent)
+
+    async def acquire(self, priority: float = 0):
+        start = time.monotonic()
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                entry = None
+            else:
+                loop = asyncio.get_running_loop()
+                entry = (priority, next(self._seq), (loop, loop.create_future()))
+                heapq.heappush(self._waiters, entry)
+
+        if entry is not None:
+            try:
+                await entry[2][1]
+            except asyncio.CancelledError:
+                with self._lock:
+                    if entry in self._waiters:  # still waiting, no slot taken
+                        self._waiters.remove(entry)
+                        heapq.heapify(self._waiters)
+                        self.cancelled += 1
+                        raise
+                self.release()  # slot handed over already, give it back
+                raise
+        self._record_wait(time.monotonic() - start)
+
+    def acquire_sync(self, priority: float = 0):
+        start = time.monotonic()
+        token = get_token()
+        if token is not None:
+            token.check()
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                entry = None
+            else:
+                entry = (priority, next(self._seq), threading.Event())
+                heapq.heappush(self._waiters, entry)
+
+        if entry is not None:
+            waiter = entry[2]
+            if token is not None:
+                token.add_callback(waiter.set)
+            waiter.wait()
+            if token is not None:
+                token.remove_callback(waiter.set)
+                if token.cancelled:
+                    with self._lock:
+                        if entry in self._waiters:  # woken by cancel, no slot taken
+                            self._waiters.remove(entry)
+                            heapq.heapify(self._waiters)
+                            self.cancelled += 1
+                            raise Cancelled("Check request cancelled")
+                    self.release()  # slot handed over already, give it back
+                    raise Cancelled("Check request cancelled")
+        self._record_wait(time.monotonic() - start)
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._in_use -= 1
+                return
+            waiter = heapq.heappop(self._waiters)[2]
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(self._wake, future)
+            except RuntimeError:  # loop closed, pass to the next waiter
+                self.release()
+
+    def _wake(self, future: asyncio.Future):
+        # future cancelled meanwhile, `acquire` gives the slot back
+        if not future.done():
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_use': self._in_use,
+                'waiting': len(self._waiters),
+                'acquired': self.acquired,
+                'wait_avg': round(self.wait_total / self.acquired, 4) if self.acquired else 0,
+                'wait_max': round(self.wait_max, 4),
+                'wait_recent': round(self.wait_recent, 4),
+                'hold_recent': round(self.hold_recent, 4),
+                'cancelled': self.cancelled,
+            }
+
+class _Slot():
+    """One use of a stage, works with both `async with` and `with`"""
+
+    def __init__(self, stage: Stage, priority: float = 0):
+        self.stage = stage
+        self.priority = priority
+        self._start = None
+
+    async def __aenter__(self):
+        await self.stage.acquire(self.priority)
+        self._start = time.monotonic()
+        return self
+
+    async def __aexit__(self, *args):
+        self.stage._record_hold(time.monotonic() - self._start)
+        self.stage.release()
+
+    def __enter__(self):
+        self.stage.acquire_sync(self.priority)
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.stage._record_hold(time.monotonic() - self._start)
+        self.stage.release()
+
+class Scheduler():
+    """
+    Process-wide concurrency limits of pipeline stages, shared by all requests.
+
+    Usage:
+      - event loop: `async with scheduler.slot('llm'): ...`
+      - threadpool: `with scheduler.slot('llm'): ...`
+
+    Do not nest slots of the same stage, it might deadlock when the stage is full.
+    """
+
+    def __init__(self, limits: dict):
+        """
+        Args:
+          - limits: stage name -> max concurrency
+        """
+        self.stages = {name: Stage(name, limit) for name, limit in limits.items()}
+
+    def slot(self, name: str, priority: float = 0) -> _Slot:
+        """Get a slot of the stage, waiters with lower priority value are served first"""
+        return _Slot(self.stages[name], priority)
+
+    def stats(self) -> dict:
+        return {name: stage.stats() for name, stage in self.stages.items()}
+
+scheduler = Scheduler({
+    'llm': settings.CONCURRENCY_LLM,
+    'embedding': settings.CONCURRENCY_EMBEDDING,
+    'rerank': settings.CONCURRENCY_RERANK,
+    'read': settings.CONCURRENCY_READ,
+    'search': settings.CONCURRENCY_SEARCH,
+    'index': settings.CONCURRENCY_INDEX,
+    'verdict': settings.CONCURRENCY_VERDICT,
+})
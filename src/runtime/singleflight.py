@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import re
+from typing import Any, Callable, Coroutine, Hashable
+
+class Flight():
+    """
+    One in-flight task and its subscribers.
+
+    Events published by the task are broadcast to all subscribers,
+    a subscriber joining late receives the events published before first.
+    """
+
+    def __init__(self, key: Hashable, on_idle: Callable = None, keep: Callable[[], bool] = None):
+        """
+        Args:
+          - key: identity of the work
+          - on_idle: function takes the flight, called when the last subscriber leaves
+          - keep: function returns whether to finish the task without subscribers
+        """
+        self.key = key
+        self.task = None
+        self.subscribers = 0
+        self.followers = 0
+        self.on_idle = on_idle
+        self.keep = keep
+
+        self._events = []
+        self._queues = []
+        self._closed = False
+
+    def publish(self, event: Any):
+        self._events.append(event)
+        for queue in self._queues:
+            queue.put_nowait(event)
+
+    def close(self):
+        """Mark the end of events, subscribers get `None` after all events"""
+        self._closed = True
+        for queue in self._queues:
+            queue.put_nowait(None)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Get a queue of all events since the start, ends with `None`"""
+        queue = asyncio.Queue()
+        for event in self._events:
+            queue.put_nowait(event)
+        if self._closed:
+            queue.put_nowait(None)
+        self._queues.append(queue)
+        self.subscribers += 1
+        return queue
+
+    def leave(self, queue: asyncio.Queue):
+        """Unsubscribe, the task keeps running for the others"""
+        self._queues.remove(queue)
+        self.subscribers -= 1
+        if not self.subscribers and self.on_idle is not None:
+            self.on_idle(self)
+
+class SingleFlight():
+    """
+    Coalesce identical in-flight work: the first caller of a key starts the task,
+    later callers of the same key subscribe to it instead of starting a duplicate one.
+
+    A subscriber leaving does not cancel the shared task,
+    subscribers should wait with `asyncio.shield(flight.task)`.
+    With `cancel_grace` set, the task is cancelled once it has no subscribers for that many seconds,
+    unless its `keep` function wants it finished.
+    The key is released once the task is done, callers after that start a new task.
+    """
+
+    def __init__(self, cancel_grace: float = None):
+        """
+        Args:
+          - cancel_grace: seconds to wait for new subscribers before cancelling an abandoned task, None to never cancel
+        """
+        self.cancel_grace = cancel_grace
+        self._flights = {}
+        self._stats = {'leaders': 0, 'followers': 0, 'cancelled': 0, 'kept': 0}
+
+    @staticmethod
+    def normalize(input: str) -> str:
+        """Normalize text input for keys: case and whitespace insensitive"""
+        return re.sub(r'\s+', ' ', input).strip().lower()
+
+    def in_flight(self, key: Hashable) -> bool:
+        flight = self._flights.get(key)
+        return flight is not None and not flight.task.done()
+
+    def join(self, key: Hashable, factory: Callable[[Callable], Coroutine], keep: Callable[[], bool] = None) -> Flight:
+        """
+        Get the in-flight task of the key, or start one with `factory`.
+        Call `subscribe` on the returned flight to receive events.
+
+        Args:
+          - key: identity of the work
+          - factory: function takes the event publish function and returns the coroutine to run,
+            called only if no task in flight
+          - keep: function returns whether to finish the task after all subscribers left, set by the first caller
+        """
+        flight = self._flights.get(key)
+        if flight is not None and not flight.task.done():
+            flight.followers += 1
+            self._stats['followers'] += 1
+            logging.info(f"Coalesced into in-flight task, followers: {flight.followers}")
+            return flight
+
+        flight = Flight(key=key, on_idle=self._idle, keep=keep)
+        flight.task = asyncio.create_task(factory(flight.publish))
+        self._flights[key] = flight
+        self._stats['leaders'] += 1
+        flight.task.add_done_callback(lambda _task: self._done(flight))
+        return flight
+
+    def _idle(self, flight: Flight):
+        if self.cancel_grace is None or flight.task.done():
+            return
+        asyncio.get_running_loop().call_later(self.cancel_grace, self._cancel_idle, flight)
+
+    def _cancel_idle(self, flight: Flight):
+        """Cancel the task if still without subscribers"""
+        if flight.subscribers or flight.task.done():
+            return
+        if flight.keep is not None and flight.keep():
+            self._stats['kept'] += 1
+            logging.info(f"All subscribers left, keep in-flight task to finish: {flight.key}")
+            return
+        self._stats['cancelled'] += 1
+        logging.info(f"All subscribers left, cancel in-flight task: {flight.key}")
+        flight.task.cancel()
+
+    def _done(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        flight.close()
+        # mark exception as retrieved in case all subscribers have left
+        if not flight.task.cancelled() and flight.task.exception():
+            logging.warning(f"In-flight task failed: {flight.task.exception()}")
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            'in_flight': len(self._flights),
+            'subscribers': sum(f.subscribers for f in self._flights.values()),
+        }
@@ -0,0 +1,176 @@
+import logging
+import threading
+
+import httpx
+
+from settings import settings
+from .deadline import remaining, timeout
+
+class Upstream():
+    """Pooled clients of one upstream service, async for the event loop and sync for threadpool"""
+
+    def __init__(self, name: str, max_connections: int, max_keepalive: int, keepalive_expiry: float):
+        self.name = name
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.aclient = None
+        self.client = None
+
+        # stats
+        self.requests = 0
+        self.errors = 0  # 5xx responses
+
+    def _count_request(self, request: httpx.Request):
+        self.requests += 1
+        self._apply_deadline(request)
+
+    @staticmethod
+    def _apply_deadline(request: httpx.Request):
+        """Cap timeouts of the request by the remaining budget of the current request deadline"""
+        if remaining() is None:
+            return
+        left = timeout(float('inf'))  # raise if passed
+        request.extensions['timeout'] = {
+            k: left if v is None else min(v, left)
+            for k, v in request.extensions.get('timeout', {}).items()
+        }
+
+    def _count_response(self, response: httpx.Response):
+        if response.is_server_error:
+            self.errors += 1
+
+    async def _acount_request(self, request: httpx.Request):
+        self._count_request(request)
+
+    async def _acount_response(self, response: httpx.Response):
+        self._count_response(response)
+
+    def get_aclient(self) -> httpx.AsyncClient:
+        if self.aclient is None or self.aclient.is_closed:
+            self.aclient = httpx.AsyncClient(
+                http2=True,
+                follow_redirects=True,
+                limits=self.limits,
+                event_hooks={'request': [self._acount_request], 'response': [self._acount_response]},
+            )
+        return self.aclient
+
+    def get_client(self) -> httpx.Client:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.Client(
+                http2=True,
+                follow_redirects=True,
+                limits=self.limits,
+                event_hooks={'request': [self._count_request], 'response': [self._count_response]},
+            )
+        return self.client
+
+    @staticmethod
+    def _pool_stats(client) -> dict:
+        """Connection pool metrics from httpcore internals, empty if not available"""
+        pool = getattr(getattr(client, '_transport', None), '_pool', None)
+        if pool is None:
+            return {}
+        connections = list(getattr(pool, 'connections', []))
+        requests = list(getattr(pool, '_requests', []))
+        return {
+            'connections': len(connections),
+            'idle': sum(1 for c in connections if c.is_idle()),
+            'http2': sum(1 for c in connections if 'HTTP2' in type(getattr(c, '_connection', None)).__name__),
+            'active_requests': len(requests),
+            'queued_requests': sum(1 for r in requests if r.is_queued()),
+        }
+
+    def stats(self) -> dict:
+        return {
+            'max_connections': self.limits.max_connections,
+            'requests': self.requests,
+            'errors': self.errors,
+            'async': self._pool_stats(self.aclient) if self.aclient else {},
+            'sync': self._pool_stats(self.client) if self.client else {},
+        }
+
+class TransportManager():
+    """
+    Shared outbound HTTP clients, one connection pool per upstream service.
+
+    Clients use HTTP/2 where the upstream supports it and keep connections alive between requests.
+    Timeouts of each request are capped by the deadline of the current request, see `runtime.deadline`.
+    Create pools at app start with `start` and close them at shutdown with `aclose`,
+    clients are also created at the first use for scripts and tests.
+
+    Usage:
+      - event loop: `transport.aclient('search').post(...)`
+      - threadpool: `transport.client('embedding').post(...)`
+    """
+
+    def __init__(self, limits: dict, max_keepalive: int, keepalive_expiry: float, default_limit: int = 100):
+        """
+        Args:
+          - limits: upstream name -> max connections
+          - max_keepalive: max idle connections kept per pool
+          - keepalive_expiry: seconds to keep an idle connection
+          - default_limit: max connections of upstreams not in `limits`
+        """
+        self.limits = limits
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.default_limit = default_limit
+
+        self._lock = threading.Lock()
+        self.upstreams = {}
+
+    def _get(self, name: str) -> Upstream:
+        with self._lock:
+            upstream = self.upstreams.get(name)
+            if upstream is None:
+                max_connections = self.limits.get(name, self.default_limit)
+                upstream = self.upstreams[name] = Upstream(
+                    name,
+                    max_connections=max_connections,
+                    max_keepalive=min(self.max_keepalive, max_connections),
+                    keepalive_expiry=self.keepalive_expiry,
+                )
+            return upstream
+
+    def aclient(self, name: str) -> httpx.AsyncClient:
+        upstream = self._get(name)
+        with self._lock:
+            return upstream.get_aclient()
+
+    def client(self, name: str) -> httpx.Client:
+        upstream = self._get(name)
+        with self._lock:
+            return upstream.get_client()
+
+    def start(self):
+        """Create async pools of the configured upstreams, call from the event loop"""
+        for name in self.limits:
+            self.aclient(name)
+
+    async def aclose(self):
+        """Close all pools"""
+        for upstream in list(self.upstreams.values()):
+            try:
+                if upstream.aclient is not None:
+                    await upstream.aclient.aclose()
+                if upstream.client is not None:
+                    upstream.client.close()
+            except Exception as e:
+                logging.warning(f"Failed to close HTTP pool {upstream.name}: {e}")
+
+    def stats(self) -> dict:
+        return {name: upstream.stats() for name, upstream in list(self.upstreams.items())}
+
+transport = TransportManager(
+    limits={
+        'search': settings.HTTP_POOL_LIMITS.get('search', settings.CONCURRENCY_READ + settings.CONCURRENCY_SEARCH),
+        'embedding': settings.HTTP_POOL_LIMITS.get('embedding', settings.CONCURRENCY_EMBEDDING),
+        'llm': settings.HTTP_POOL_LIMITS.get('llm', settings.CONCURRENCY_LLM),
+    },
+    max_keepalive=settings.HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+)
@@ -20,6 +20,7 @@ class Settings:
         self.RERANK_MODEL_DEPLOY = os.environ.get("RERANK_MODEL_DEPLOY") or "local"
 
         # keys
+        self.OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") or ""
         self.EMBEDDING_API_KEY = os.environ.get("EMBEDDING_API_KEY") or ""
         self.RERANK_API_KEY = os.environ.get("RERANK_API_KEY") or ""
 
@@ -37,15 +38,120 @@ class Settings:
             - set higher to improve performance: overcome network latency, etc.
             - embedding servers usually have the capacity to divide too large batch on their own
         """
-        self.EMBEDDING_BATCH_SIZE = os.environ.get("EMBEDDING_BATCH_SIZE") or 1024
+        self.EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE") or 1024)
+        self.EMBEDDING_ENCODING_FORMAT = os.environ.get("EMBEDDING_ENCODING_FORMAT") or "base64"  # base64 | float, wire format of Infinity embeddings
+        self.EMBEDDING_TARGET_LATENCY = int(os.environ.get("EMBEDDING_TARGET_LATENCY") or 2000)  # in milliseconds, slower requests shrink the sub-batch size
+        self.EMBEDDING_BATCH_WINDOW = int(os.environ.get("EMBEDDING_BATCH_WINDOW") or 5)  # in milliseconds, texts of concurrent callers within the window are sent in one request
 
         # optimizer
         self.OPTIMIZER_FILE_NAME = os.environ.get("OPTIMIZER_FILE_NAME") or "verdict_MIPROv2.json"
 
-        # concurrency
-        self.CONCURRENCY_VERDICT = os.environ.get("CONCURRENCY_VERDICT") or 8
+        # LLM execution mode, async mode runs DSPy modules on the event loop with a shared async client
+        self.LLM_ASYNC = (os.environ.get("LLM_ASYNC") or "false").lower() == "true"
+
+        # LLM batching in async mode, prompts from concurrent sources within the window are sent together
+        self.LLM_BATCH = (os.environ.get("LLM_BATCH") or "false").lower() == "true"
+        self.LLM_BATCH_WINDOW = int(os.environ.get("LLM_BATCH_WINDOW") or 10)  # in milliseconds
+        self.LLM_BATCH_MAX_SIZE = int(os.environ.get("LLM_BATCH_MAX_SIZE") or 16)  # max prompts per batch
+
+        # verdict early stop, cancel the remaining sources of a statement once the verdict is settled
+        self.VERDICT_EARLY_STOP = (os.environ.get("VERDICT_EARLY_STOP") or "false").lower() == "true"
+        self.VERDICT_QUORUM_MARGIN = int(os.environ.get("VERDICT_QUORUM_MARGIN") or 0)  # stop once true/false score margin reaches this, 0 to stop only when the verdict can no longer flip
+
+        # long input mode, split input into chunks and extract statements from chunks concurrently
+        self.LONG_INPUT_MODE = (os.environ.get("LONG_INPUT_MODE") or "false").lower() == "true"
+        self.LONG_INPUT_CHUNK_SIZE = int(os.environ.get("LONG_INPUT_CHUNK_SIZE") or 2000)  # in characters, shorter input runs in the default mode
+        self.LONG_INPUT_MAX_STATEMENTS = int(os.environ.get("LONG_INPUT_MAX_STATEMENTS") or 20)  # max statements to check per request
+
+        # source pipeline starts at the first valid doc of the source, docs read within the window after it are included
+        self.SOURCE_GATHER_WINDOW = float(os.environ.get("SOURCE_GATHER_WINDOW") or 2)  # in seconds
+
+        # per request budget of LLM calls, sources or statements beyond it are skipped, 0 for no limit
+        self.LLM_CALLS_BUDGET = int(os.environ.get("LLM_CALLS_BUDGET") or 500)
+
+        # rerank batching in local deploy mode, concurrent requests within the window run in one forward pass
+        self.RERANK_BATCH_WINDOW = int(os.environ.get("RERANK_BATCH_WINDOW") or 5)  # in milliseconds
+        self.RERANK_BATCH_MAX_SIZE = int(os.environ.get("RERANK_BATCH_MAX_SIZE") or 256)  # max query-text pairs per forward pass
+
+        # concurrency, limits of each stage are shared by all requests
+        self.CONCURRENCY_VERDICT = int(os.environ.get("CONCURRENCY_VERDICT") or 8)  # sources generating verdict
+        self.CONCURRENCY_LLM = int(os.environ.get("CONCURRENCY_LLM") or 16)  # LLM calls
+        self.CONCURRENCY_EMBEDDING = int(os.environ.get("CONCURRENCY_EMBEDDING") or 8)  # embedding requests
+        self.CONCURRENCY_RERANK = int(os.environ.get("CONCURRENCY_RERANK") or 8)  # rerank requests
+        self.CONCURRENCY_INDEX = int(os.environ.get("CONCURRENCY_INDEX") or 8)  # index builds
+        self.CONCURRENCY_READ = int(os.environ.get("CONCURRENCY_READ") or 32)  # URL reads
+        self.CONCURRENCY_SEARCH = int(os.environ.get("CONCURRENCY_SEARCH") or 8)  # web searches
+
+        # per-host governor of URL reads
+        self.READ_HOST_RATE = float(os.environ.get("READ_HOST_RATE") or 2)  # requests per second per host, set 0 to disable
+        self.READ_HOST_BURST = int(os.environ.get("READ_HOST_BURST") or 4)  # max requests per host at once before rate limit
+        self.READ_BREAKER_FAILURES = int(os.environ.get("READ_BREAKER_FAILURES") or 3)  # consecutive failures to skip a host
+        self.READ_BREAKER_COOLDOWN = int(os.environ.get("READ_BREAKER_COOLDOWN") or 300)  # in seconds, skip a failing host for
+        self.READ_MAX_HOSTS = int(os.environ.get("READ_MAX_HOSTS") or 10000)  # max number of hosts to keep rate limit and breaker state of
+
+        # outbound HTTP connection pools, one per upstream: search, embedding, llm
+        try:
+            self.HTTP_POOL_LIMITS = ast.literal_eval(os.environ.get("HTTP_POOL_LIMITS"))  # upstream -> max connections, defaults follow stage concurrency
+        except (ValueError, SyntaxError):
+            self.HTTP_POOL_LIMITS = {}
+        self.HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE") or 20)  # max idle connections kept per pool
+        self.HTTP_KEEPALIVE_EXPIRY = int(os.environ.get("HTTP_KEEPALIVE_EXPIRY") or 60)  # in seconds
+
+        # admission control of check requests, rejected ones get 503 with `Retry-After`
+        self.ADMISSION_MAX_CHECKS = int(os.environ.get("ADMISSION_MAX_CHECKS") or 16)  # max checks running at once, set 0 for no limit
+        self.ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE") or 32)  # max checks waiting for admission
+        self.ADMISSION_QUEUE_TIMEOUT = int(os.environ.get("ADMISSION_QUEUE_TIMEOUT") or 10)  # in seconds, max wait for admission
+        try:
+            self.ADMISSION_STAGE_QUEUE = ast.literal_eval(os.environ.get("ADMISSION_STAGE_QUEUE"))  # stage -> max waiters, defaults to 4x concurrency of llm and embedding
+        except (ValueError, SyntaxError):
+            self.ADMISSION_STAGE_QUEUE = {}
+        self.ADMISSION_MAX_STAGE_WAIT = int(os.environ.get("ADMISSION_MAX_STAGE_WAIT") or 30)  # in seconds, max recent wait of the stages above, set 0 to disable
 
         # web
         self.STREAM_TIME_OUT = os.environ.get("STREAM_TIME_OUT") or 300  # in seconds
+        self.DISCONNECT_CANCEL = (os.environ.get("DISCONNECT_CANCEL") or "true").lower() == "true"  # cancel checks abandoned by all clients
+        self.DISCONNECT_GRACE = float(os.environ.get("DISCONNECT_GRACE") or 5)  # in seconds, wait for clients to reconnect before cancelling
+        self.DISCONNECT_KEEP_PROGRESS = float(os.environ.get("DISCONNECT_KEEP_PROGRESS") or 0.5)  # finish abandoned checks with this share of statements done, to fill the verdict cache
+        self.DEADLINE_RESERVE = int(os.environ.get("DEADLINE_RESERVE") or 10)  # in seconds, pipeline deadline ahead of `STREAM_TIME_OUT` to return partial results
+
+        # asynchronous jobs: `POST /jobs` queues a check, workers in the web process or `python -m jobs` run it
+        self.JOB_STORE = os.environ.get("JOB_STORE") or "sqlite"  # memory | sqlite | redis, use redis for workers on multiple hosts
+        self.JOB_STORE_URL = os.environ.get("JOB_STORE_URL") or "redis://localhost:6379/0"
+        self.JOB_WORKERS = int(os.environ.get("JOB_WORKERS") or 2)  # jobs running at once in this process, set 0 to only queue jobs
+        self.JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE") or 1000)  # max queued jobs, set 0 for no limit
+        self.JOB_LEASE = int(os.environ.get("JOB_LEASE") or 60)  # in seconds, jobs of a stopped worker are requeued after this
+        self.JOB_POLL_INTERVAL = int(os.environ.get("JOB_POLL_INTERVAL") or 500)  # in milliseconds
+        self.JOB_TIME_OUT = int(os.environ.get("JOB_TIME_OUT") or 600)  # in seconds, deadline of each job
+        self.JOB_TTL = int(os.environ.get("JOB_TTL") or 86400)  # in seconds, keep finished jobs
+
+        # retry budgets shared by all layers, retries need tokens of both the upstream and the request budget
+        self.RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO") or 0.2)  # upstream retry tokens earned by each call
+        self.RETRY_BUDGET_MAX_TOKENS = int(os.environ.get("RETRY_BUDGET_MAX_TOKENS") or 20)  # max upstream retry tokens
+        self.RETRY_REQUEST_BUDGET = int(os.environ.get("RETRY_REQUEST_BUDGET") or 20)  # max retries of one check request, set 0 to disable
+        self.RETRY_BACKOFF_BASE = int(os.environ.get("RETRY_BACKOFF_BASE") or 100)  # in milliseconds, doubled for each retry with full jitter
+        self.RETRY_BACKOFF_MAX = int(os.environ.get("RETRY_BACKOFF_MAX") or 5000)  # in milliseconds
+
+        # hedged requests of search and read APIs: send a duplicate once a call is slower than the observed latency quantile
+        self.HEDGE = (os.environ.get("HEDGE") or "true").lower() == "true"
+        self.HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE") or 0.95)
+        self.HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES") or 20)  # successful calls to observe before hedging
+
+        # cache
+        self.CACHE_DIR = os.environ.get("CACHE_DIR") or "/data/cache/check"
+        self.VERDICT_CACHE_TTL = int(os.environ.get("VERDICT_CACHE_TTL") or 86400)  # in seconds, set 0 to disable
+        self.VERDICT_CACHE_MAX_SIZE = int(os.environ.get("VERDICT_CACHE_MAX_SIZE") or 100000)  # max number of statements
+        self.READ_CACHE_TTL = int(os.environ.get("READ_CACHE_TTL") or 21600)  # in seconds, set 0 to disable
+        self.READ_CACHE_MAX_MEMORY = int(os.environ.get("READ_CACHE_MAX_MEMORY") or 1000)  # max number of URLs in memory, others spill to disk
+        self.READ_CACHE_MAX_DISK = int(os.environ.get("READ_CACHE_MAX_DISK") or 1024)  # in MB, max size of URLs spilled to disk
+        self.EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE") or 100000)  # max number of vectors per model, in memory or on disk, set 0 to disable
+        self.EMBEDDING_CACHE_DISK = (os.environ.get("EMBEDDING_CACHE_DISK") or "false").lower() == "true"  # use memory-mapped store on disk instead
+        self.EVIDENCE_STORE = (os.environ.get("EVIDENCE_STORE") or "false").lower() == "true"  # use the long-lived evidence store instead of per-request indexes
+        self.EVIDENCE_STORE_TTL = int(os.environ.get("EVIDENCE_STORE_TTL") or 604800)  # in seconds, max age of stored chunks, set 0 to keep until evicted by size
+        self.EVIDENCE_STORE_MAX_SIZE = int(os.environ.get("EVIDENCE_STORE_MAX_SIZE") or 200000)  # max number of stored chunks
+        try:
+            # TTL of specific domains, for example: {"example.com": 3600, "static.example.org": 604800}
+            self.READ_CACHE_DOMAIN_TTL = ast.literal_eval(os.environ.get("READ_CACHE_DOMAIN_TTL"))
+        except (ValueError, SyntaxError):
+            self.READ_CACHE_DOMAIN_TTL = {}
     
 settings = Settings()
\ No newline at end of file
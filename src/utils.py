@@ -68,6 +68,8 @@ def generate_report_markdown(input_text, summaries):
             markdown.append(f"**Verdict**: {verdict.capitalize()}\n")
         else:
             markdown.append("**Verdict**: None\n")
+        if summary.get('partial'):
+            markdown.append("**Partial**: deadline reached, verdict of the sources finished in time\n")
 
         # Add weights
         weights = summary['weights']
@@ -94,6 +96,61 @@ def generate_report_markdown(input_text, summaries):
     markdown_str = "\n".join(markdown)
     return markdown_str
 
+def split_text(text: str, chunk_size: int) -> List[str]:
+    """
+    Split text into chunks of at most `chunk_size` characters.
+    Keep paragraphs together when possible, split long paragraphs by sentences.
+    A single sentence longer than `chunk_size` is kept as one chunk.
+    """
+    pieces = []  # (text, separator to the previous piece)
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_size:
+            pieces.append((paragraph, "\n\n"))
+        else:
+            sentences = [s for s in re.split(r'(?<=[.!?])\s+', paragraph) if s]
+            pieces.extend((s, "\n\n" if i == 0 else " ") for i, s in enumerate(sentences))
+
+    chunks = []
+    for piece, sep in pieces:
+        if chunks and len(chunks[-1]) + len(sep) + len(piece) <= chunk_size:
+            chunks[-1] += sep + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+def _get_tokens(text: str) -> set:
+    return set(re.findall(r'\w+', text.lower()))
+
+def is_near_duplicate(a: str, b: str, threshold: float = 0.8) -> bool:
+    """Check if two statements are near identical by Jaccard similarity of word sets"""
+    tokens_a, tokens_b = _get_tokens(a), _get_tokens(b)
+    if not tokens_a or not tokens_b:
+        return tokens_a == tokens_b
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b) >= threshold
+
+def get_check_worthiness(statement: str) -> int:
+    """
+    Score how worth checking a statement is, higher first.
+    Heuristic without LLM calls to keep cost predictable:
+      - numbers, dates and named entities are verifiable facts
+      - opinions, hedges and questions are less checkable
+    """
+    score = 0
+    words = statement.split()
+    if re.search(r'\d', statement):
+        score += 2
+    score += min(3, sum(1 for w in words[1:] if w[:1].isupper()))  # likely named entities
+    if 6 <= len(words) <= 40:
+        score += 1
+    if statement.strip().endswith('?'):
+        score -= 2
+    if re.search(r'\b(i think|i believe|in my opinion|maybe|perhaps|might|should|could)\b', statement.lower()):
+        score -= 2
+    return score
+
 def check_input(input):
     """
     Check if the input are checkable.
@@ -200,7 +257,7 @@ def calculate_percentage(part, whole):
     percentage = round((part / whole) * 100)
     return f"{percentage}%"
     
-# generate str for stream
+# generate str for stream, one JSON message per line
 def get_stream(stage: str = 'wait', content = None):
     message = {"stage": stage, "content": content}
-    return json.dumps(message)
\ No newline at end of file
+    return json.dumps(message) + "\n"
\ No newline at end of file
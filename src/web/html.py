@@ -1,7 +1,8 @@
 """
 Default HTML page.
-It will fetch the same url with streaming header and process response as JSON.
-If `stage` in response is `wait`, skip this part; else display the response with MARKDOWN formatting.
+It will fetch the same url with streaming header and process response as JSON lines.
+If `stage` in response is `wait`, skip this part; `final` is displayed with MARKDOWN formatting,
+other stages are displayed as progress lines until the final one arrives.
 
 Purpose of this setup:
   - Display multiple stages.
@@ -19,6 +20,30 @@ html_browser = """
     <div id="content"></div>
     <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
     <script>
+        const progress = [];
+
+        function render(message) {
+            if (message.stage == "wait") return;
+            const content = message.content;
+            if (message.stage == "final" || typeof content == "string") {
+                if (message.stage == "final" || progress.length == 0) {
+                    document.getElementById('content').innerHTML = marked.parse(content);
+                }
+                return;
+            }
+
+            if (message.stage == "statements") {
+                progress.push(`**Statements**: ${content.length} found`);
+            } else if (message.stage == "query") {
+                progress.push(`**Searching**: ${content.query}`);
+            } else if (message.stage == "verdict") {
+                progress.push(`- ${content.source}: ${content.verdict}`);
+            } else if (message.stage == "summary") {
+                progress.push(`**${content.statement}**: ${content.verdict}`);
+            }
+            document.getElementById('content').innerHTML = marked.parse(progress.join("\\n\\n"));
+        }
+
         async function fetchData() {
             try {
                 const response = await fetch(window.location.href, {
@@ -36,15 +61,17 @@ html_browser = """
                     const { done, value } = await reader.read();
                     if (done) break;
 
-                    let part = decoder.decode(value, { stream: true });
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\\n');
+                    buffer = lines.pop();  // keep the incomplete line
 
-                    try {
-                        const message = JSON.parse(part);
-                        if (message.stage != "wait") {
-                            document.getElementById('content').innerHTML = marked.parse(message.content);
+                    for (const line of lines) {
+                        if (!line.trim()) continue;
+                        try {
+                            render(JSON.parse(line));
+                        } catch (e) {
+                            console.error("Error parsing JSON:", e);
                         }
-                    } catch (e) {
-                        console.error("Error parsing JSON:", e);
                     }
                 }
             } catch (error) {